@@ -1,10 +1,18 @@
+import os
+import time
 import streamlit as st
+import metrics
+from auth import CredentialStore
+from catalog import detect_format
 from code import Library, User
+from overdue import OverdueScanner
 from datetime import datetime
+import numpy as np
 import pandas as pd
 
 # Page configuration
 st.set_page_config(page_title="Library Management System", layout="wide", initial_sidebar_state="expanded")
+render_start = time.perf_counter()
 
 # Add custom CSS for background and styling
 def add_bg_from_url():
@@ -81,23 +89,84 @@ def add_bg_from_url():
 
 add_bg_from_url()
 
+@st.cache_resource
+def get_credentials() -> CredentialStore:
+    """Shared credential store; verified session tokens are cached across sessions"""
+    return CredentialStore(os.environ.get('LMS_USERS', 'users.json'))
+
 # Initialize session state
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
     st.session_state.username = None
+    # A session token in the URL resumes the login after a browser refresh
+    resumed_user = get_credentials().verify_token(st.query_params.get('session'))
+    if resumed_user:
+        st.session_state.logged_in = True
+        st.session_state.username = resumed_user
+elif st.session_state.logged_in:
+    # Checked on every rerun (a cached lookup), so a logout in another tab
+    # or a password change ends sessions that are already open
+    if get_credentials().verify_token(st.query_params.get('session')) != st.session_state.username:
+        st.session_state.logged_in = False
+        st.session_state.username = None
+
+@st.cache_resource
+def get_library(storage: str) -> Library:
+    """One shared Library per server process, reused across reruns and sessions"""
+    # LMS_WRITE_BEHIND=1: issue/return buttons don't wait for the disk write
+    return Library(storage=storage, write_behind=os.environ.get('LMS_WRITE_BEHIND') == '1')
+
+@st.cache_resource
+def get_overdue_scanner(storage: str) -> OverdueScanner:
+    """Overdue loans of the shared library, rescanned once a minute in the background"""
+    scanner = OverdueScanner(get_library(storage))
+    scanner.scan()
+    scanner.start()
+    return scanner
+
+@st.cache_resource
+def start_metrics_server(port: int, host: str):
+    """Serve Prometheus metrics on /metrics once per server process"""
+    return metrics.serve(port, host)
+
+if os.environ.get('LMS_METRICS_PORT'):
+    # Unauthenticated, so only reachable from this machine unless LMS_METRICS_HOST says otherwise
+    start_metrics_server(int(os.environ['LMS_METRICS_PORT']), os.environ.get('LMS_METRICS_HOST', '127.0.0.1'))
+
+PAGE_SIZES = [25, 50, 100]
+SEARCH_RESULTS = 20
+
+def fetch_page(query, key: str):
+    """Run a paged Library query under page controls; returns one page of rows and the total"""
+    size_col, page_col, info_col = st.columns([1, 1, 2])
+    with size_col:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_page_size")
+    
+    page = st.session_state.get(f"{key}_page", 1)
+    rows, total = query(offset=(page - 1) * page_size, limit=page_size)
+    pages = max(1, -(-total // page_size))
+    if page > pages:
+        # Filters shrank the result; jump to its last page
+        page = pages
+        rows, total = query(offset=(page - 1) * page_size, limit=page_size)
+    st.session_state[f"{key}_page"] = page
+    
+    with page_col:
+        st.number_input("Page", min_value=1, max_value=pages, key=f"{key}_page")
+    with info_col:
+        first = (page - 1) * page_size
+        st.caption(f"Rows {min(first + 1, total)}-{first + len(rows)} of {total}")
+    rows.index = range(first + 1, first + len(rows) + 1)
+    return rows, total
 
-# Simple authentication
+# Authentication against salted password hashes
 def authenticate(username, password):
-    """Simple authentication - hardcoded for demo"""
-    users = {
-        'admin': 'admin123',
-        'user1': 'pass123',
-        'user2': 'pass123'
-    }
-    return username in users and users[username] == password
+    """Check a login; the demo accounts are created in users.json on first run"""
+    return get_credentials().verify_password(username, password)
 
 # Sidebar for navigation
 if not st.session_state.logged_in:
+    metrics.count_rerun("Login")
     st.title("📚 Library Management System")
     st.write("Please login to access the library system")
     
@@ -110,6 +179,7 @@ if not st.session_state.logged_in:
             if authenticate(username, password):
                 st.session_state.logged_in = True
                 st.session_state.username = username
+                st.query_params['session'] = get_credentials().issue_token(username)
                 st.success(f"Welcome, {username}!")
                 st.rerun()
             else:
@@ -119,6 +189,8 @@ else:
     st.sidebar.title(f"👤 {st.session_state.username}")
     
     if st.sidebar.button("Logout", key="logout_btn"):
+        get_credentials().revoke_token(st.query_params.get('session'))
+        st.query_params.pop('session', None)
         st.session_state.logged_in = False
         st.session_state.username = None
         st.rerun()
@@ -131,35 +203,51 @@ else:
                             "My Borrowed Books",
                             "Return Book",
                             "View All Issued Books",
-                            "Add New Book (Admin)"])
+                            "Add New Book (Admin)",
+                            "Bulk Return (Admin)",
+                            "Analytics (Admin)",
+                            "Performance (Admin)"])
+    metrics.count_rerun(page)
     
-    # Initialize library
-    library = Library()
+    # Shared library (LMS_STORAGE=journal enables append-only persistence);
+    # only re-read from disk when another process has changed the data file
+    library = get_library(os.environ.get('LMS_STORAGE', 'json'))
+    library.refresh()
+    overdue = get_overdue_scanner(os.environ.get('LMS_STORAGE', 'json')).report
     
     # ==================== DASHBOARD ====================
     if page == "Dashboard":
         st.title("📊 Dashboard")
         
-        col1, col2, col3 = st.columns(3)
+        col1, col2, col3, col4 = st.columns(4)
+        
+        # Running totals kept by the library, no catalog scan per rerun
+        stats = library.get_stats()
         
         with col1:
-            total_books = sum(book['total_copies'] for book in library.data['books'].values())
-            st.metric("Total Books", total_books)
+            st.metric("Total Books", stats['total_copies'])
         
         with col2:
-            available_books = sum(book['available_copies'] for book in library.data['books'].values())
-            st.metric("Available Copies", available_books)
+            st.metric("Available Copies", stats['available_copies'])
         
         with col3:
-            issued_books = len(library.data['issued_books'])
-            st.metric("Issued Books", issued_books)
+            st.metric("Issued Books", stats['issued'])
+        
+        with col4:
+            # Precomputed by the background scanner
+            newly_overdue = len(overdue.newly_overdue())
+            st.metric("Overdue", overdue.count,
+                      delta=f"{newly_overdue} since yesterday" if newly_overdue else None, delta_color="inverse")
         
         st.divider()
         
         # User's borrowed books summary
+        user_stats = library.get_user_stats(st.session_state.username)
         user_books = library.get_user_borrowed_books(st.session_state.username)
         
-        st.subheader(f"Your Borrowed Books ({len(user_books)})")
+        st.subheader(f"Your Borrowed Books ({user_stats['borrowed']})")
+        if user_stats['overdue']:
+            st.warning(f"{user_stats['overdue']} of your books are overdue")
         if user_books:
             for book in user_books:
                 col1, col2, col3, col4 = st.columns(4)
@@ -173,7 +261,9 @@ else:
                     else:
                         st.info(f"✅ {book['days_remaining']} days left")
                 with col4:
-                    st.write(f"ID: {book['transaction_id'][:20]}...")
+                    trans_id = book['transaction_id']
+                    # IDs from before sequence numbers can be long
+                    st.write(f"ID: {trans_id if len(trans_id) <= 20 else trans_id[:20] + '...'}")
         else:
             st.info("You haven't borrowed any books yet.")
     
@@ -181,24 +271,25 @@ else:
     elif page == "View Available Books":
         st.title("📚 Available Books")
         
-        available_books = library.get_available_books()
+        name_filter = st.text_input("Filter by title:", "")
         
-        if available_books:
-            # Create a dataframe for better display
-            books_data = []
-            for book_name, info in available_books.items():
-                books_data.append({
-                    'Book Name': book_name,
-                    'Total Copies': info['total_copies'],
-                    'Available': info['available_copies'],
-                    'Issued': info['total_copies'] - info['available_copies']
-                })
-            
-            df = pd.DataFrame(books_data)
-            df.index = df.index + 1
+        def query(offset, limit):
+            return library.query_books(name_filter=name_filter, available_only=True, offset=offset, limit=limit)
+        
+        books, total = fetch_page(query, "available_books")
+        
+        if total:
+            df = books.rename(columns={
+                'title': 'Book Name',
+                'total_copies': 'Total Copies',
+                'available_copies': 'Available',
+                'issued': 'Issued'
+            })
             st.dataframe(df, use_container_width=True)
             
-            st.success(f"Total {len(available_books)} books available for issue")
+            st.success(f"Total {total} books available for issue")
+        elif name_filter:
+            st.info("No available books match your filter.")
         else:
             st.warning("No books available at the moment.")
     
@@ -206,14 +297,19 @@ else:
     elif page == "Issue Book":
         st.title("📖 Issue a Book")
         
-        available_books = library.get_available_books()
+        # Only the top matches are sent to the browser, never the whole catalog
+        search = st.text_input("Search for a book:", placeholder="Type part of a title, e.g. gatsby")
+        if search:
+            book_names = library.search_books(search, limit=SEARCH_RESULTS, available_only=True)
+        else:
+            books, _ = library.query_books(available_only=True, limit=SEARCH_RESULTS)
+            book_names = books['title'].tolist()
         
-        if available_books:
-            book_names = list(available_books.keys())
+        if book_names:
             selected_book = st.selectbox("Select a book to issue:", book_names)
             
             if selected_book:
-                book_info = available_books[selected_book]
+                book_info = library.data['books'][selected_book]
                 col1, col2 = st.columns(2)
                 with col1:
                     st.metric("Total Copies", book_info['total_copies'])
@@ -229,6 +325,8 @@ else:
                         st.rerun()
                     else:
                         st.error(message)
+        elif search:
+            st.warning(f"No available books match '{search}'.")
         else:
             st.error("No books available for issue at the moment.")
     
@@ -296,45 +394,45 @@ else:
     elif page == "View All Issued Books":
         st.title("📋 All Issued Books")
         
-        issued_books = library.get_issued_books()
+        # Filter options
+        col1, col2 = st.columns(2)
+        with col1:
+            filter_user = st.text_input("Filter by user (leave empty for all):", "")
+        with col2:
+            show_overdue = st.checkbox("Show only overdue books")
+        
+        def query(offset, limit):
+            return library.query_loans(user_filter=filter_user, overdue_only=show_overdue,
+                                       offset=offset, limit=limit)
         
-        if issued_books:
-            # Filter options
-            col1, col2 = st.columns(2)
-            with col1:
-                filter_user = st.text_input("Filter by user (leave empty for all):", "")
-            with col2:
-                show_overdue = st.checkbox("Show only overdue books")
-            
-            # Apply filters
-            filtered_books = issued_books
-            if filter_user:
-                filtered_books = [b for b in filtered_books if filter_user.lower() in b['user'].lower()]
-            if show_overdue:
-                filtered_books = [b for b in filtered_books if b['days_remaining'] < 0]
-            
-            if filtered_books:
-                # Create dataframe
-                books_data = []
-                for book in filtered_books:
-                    status = "⚠️ OVERDUE" if book['days_remaining'] < 0 else "✅ ON TIME"
-                    books_data.append({
-                        'User': book['user'],
-                        'Book': book['book'],
-                        'Issue Date': book['issue_date'],
-                        'Due Date': book['due_date'],
-                        'Days Remaining': book['days_remaining'],
-                        'Status': status
-                    })
-                
-                df = pd.DataFrame(books_data)
-                df.index = df.index + 1
-                st.dataframe(df, use_container_width=True)
-                st.success(f"Total {len(filtered_books)} issued books matching filters")
-            else:
-                st.info("No issued books match your filters.")
+        filtered_books, total = fetch_page(query, "issued_books")
+        
+        if total:
+            # Create dataframe
+            df = pd.DataFrame({
+                'User': filtered_books['user'],
+                'Book': filtered_books['book'],
+                'Issue Date': filtered_books['issue_date'],
+                'Due Date': filtered_books['due_date'],
+                'Days Remaining': filtered_books['days_remaining'],
+                'Status': np.where(filtered_books['is_overdue'], "⚠️ OVERDUE", "✅ ON TIME")
+            }, index=filtered_books.index)
+            st.dataframe(df, use_container_width=True)
+            st.success(f"Total {total} issued books matching filters")
+        elif filter_user or show_overdue:
+            st.info("No issued books match your filters.")
         else:
             st.info("No books have been issued yet.")
+        
+        if st.session_state.username == "admin" and overdue.count:
+            reminders = pd.DataFrame([
+                {'Transaction ID': trans_id, 'User': details['user'], 'Book': details['book'],
+                 'Due Date': details['due_date']}
+                for trans_id, details in overdue.loans.items()
+            ])
+            st.download_button(f"Download overdue reminders ({overdue.count})",
+                               reminders.to_csv(index=False), file_name="overdue_reminders.csv",
+                               mime="text/csv")
     
     # ==================== ADD NEW BOOK (ADMIN) ====================
     elif page == "Add New Book (Admin)":
@@ -357,20 +455,176 @@ else:
                 else:
                     st.error(message)
             
+            st.divider()
+            st.subheader("Import Catalog")
+            st.write("Upload a CSV or JSON Lines file with a `title` and an optional `copies` column. "
+                     "Titles already in the library get the extra copies added.")
+            
+            catalog_file = st.file_uploader("Catalog file:", type=['csv', 'jsonl', 'ndjson'])
+            if catalog_file is not None and st.button("Import Catalog"):
+                total_rows = max(1, catalog_file.getvalue().count(b'\n'))
+                progress_bar = st.progress(0.0, text="Importing...")
+                
+                def show_progress(summary):
+                    progress_bar.progress(min(summary['rows'] / total_rows, 1.0),
+                                          text=f"Imported {summary['rows']:,} rows")
+                
+                try:
+                    summary = library.import_catalog(catalog_file, detect_format(catalog_file.name),
+                                                     progress=show_progress)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    progress_bar.progress(1.0, text="Import complete")
+                    st.success(f"Added {summary['added']:,} new titles and restocked {summary['restocked']:,} "
+                               f"with {summary['copies']:,} copies in total.")
+                    if summary['skipped']:
+                        st.warning(f"Skipped {summary['skipped']:,} rows without a valid title or copy count.")
+            
             st.divider()
             st.subheader("Current Books in Library")
             
-            books_data = []
-            for book_name, info in library.data['books'].items():
-                books_data.append({
-                    'Book Name': book_name,
-                    'Total Copies': info['total_copies'],
-                    'Available': info['available_copies'],
-                    'Issued': info['total_copies'] - info['available_copies']
+            books, total = fetch_page(library.query_books, "catalog")
+            df = books.rename(columns={
+                'title': 'Book Name',
+                'total_copies': 'Total Copies',
+                'available_copies': 'Available',
+                'issued': 'Issued'
+            })
+            st.dataframe(df, use_container_width=True)
+        else:
+            st.error("❌ Admin access only. Please login as admin.")
+    
+    # ==================== BULK RETURN (ADMIN) ====================
+    elif page == "Bulk Return (Admin)":
+        if st.session_state.username == "admin":
+            st.title("📥 Bulk Return")
+            st.write("Paste the transaction IDs of returned books, one per line.")
+            
+            ids_text = st.text_area("Transaction IDs:", height=200)
+            transaction_ids = [line.strip() for line in ids_text.splitlines() if line.strip()]
+            
+            if st.button("Return All", disabled=not transaction_ids):
+                # One transaction and one write for the whole batch
+                results = library.return_many(transaction_ids)
+                returned = sum(success for success, _ in results)
+                
+                if returned == len(results):
+                    st.success(f"Returned {returned} books.")
+                else:
+                    st.warning(f"Returned {returned} of {len(results)} books.")
+                
+                df = pd.DataFrame({
+                    'Transaction ID': transaction_ids,
+                    'Result': ["✅ Returned" if success else "❌ Failed" for success, _ in results],
+                    'Message': [message for _, message in results]
                 })
+                df.index = df.index + 1
+                st.dataframe(df, use_container_width=True)
+        else:
+            st.error("❌ Admin access only. Please login as admin.")
+    
+    # ==================== ANALYTICS (ADMIN) ====================
+    elif page == "Analytics (Admin)":
+        if st.session_state.username == "admin":
+            st.title("📈 Circulation Analytics")
             
-            df = pd.DataFrame(books_data)
-            df.index = df.index + 1
-            st.dataframe(df, use_container_width=True)
+            # Everything here reads rollups kept up to date on each issue and return
+            summary = library.get_circulation_summary()
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("Loans (All Time)", summary['loans'])
+            with col2:
+                st.metric("Completed Loans", summary['completed'])
+            with col3:
+                st.metric("Mean Loan Length", f"{summary['mean_loan_days']:.1f} days")
+            with col4:
+                st.metric("Copies On Loan", f"{summary['utilization']:.0%}")
+            
+            st.subheader("Most Borrowed Books")
+            top_n = st.selectbox("Show top", [10, 25, 50], key="analytics_top_n")
+            popular = library.get_popular_books(top_n)
+            if len(popular):
+                st.bar_chart(popular.set_index('book')['borrows'])
+                st.dataframe(pd.DataFrame({
+                    'Book': popular['book'],
+                    'Times Borrowed': popular['borrows'],
+                    'Mean Loan (days)': popular['mean_loan_days'].round(1),
+                    'Copies On Loan': (popular['utilization'] * 100).round().astype(int).astype(str) + '%'
+                }, index=range(1, len(popular) + 1)), use_container_width=True)
+            else:
+                st.info("No books have been borrowed yet.")
+            
+            st.subheader("Daily Circulation")
+            days = st.selectbox("Period (days)", [30, 90, 365], key="analytics_days")
+            st.line_chart(library.get_daily_circulation(days).set_index('date'))
+            
+            st.subheader("Recently Returned")
+            recent = library.get_loan_history(20)
+            if recent:
+                st.dataframe(pd.DataFrame({
+                    'User': [loan['user'] for loan in recent],
+                    'Book': [loan['book'] for loan in recent],
+                    'Issued': [loan['issue_date'] for loan in recent],
+                    'Returned': [loan['date'] for loan in recent],
+                    'Days': [round(loan['days'], 1) for loan in recent]
+                }, index=range(1, len(recent) + 1)), use_container_width=True)
+            else:
+                st.info("No loans have been completed yet.")
         else:
             st.error("❌ Admin access only. Please login as admin.")
+    
+    # ==================== PERFORMANCE (ADMIN) ====================
+    elif page == "Performance (Admin)":
+        if st.session_state.username == "admin":
+            st.title("⏱️ Performance")
+            registry = metrics.REGISTRY
+            registry.enabled = st.toggle("Collect metrics", value=registry.enabled)
+            if not registry.enabled:
+                st.info("Metrics collection is off. Switch it on above or start the app with LMS_METRICS=1.")
+            
+            def latency_table(histogram, label):
+                rows = histogram.summary()
+                return pd.DataFrame({
+                    label: [row[histogram.label] for row in rows],
+                    'Calls': [row['count'] for row in rows],
+                    'Mean (ms)': [row['mean'] * 1000 for row in rows],
+                    'p50 (ms)': [row['p50'] * 1000 for row in rows],
+                    'p95 (ms)': [row['p95'] * 1000 for row in rows],
+                    'Max (ms)': [row['max'] * 1000 for row in rows]
+                })
+            
+            st.subheader("Library Operations")
+            st.dataframe(latency_table(registry.operation_seconds, 'Operation'), use_container_width=True)
+            
+            st.subheader("Page Renders")
+            renders = latency_table(registry.page_render_seconds, 'Page')
+            renders['Reruns'] = [registry.reruns.values.get(page_name, 0) for page_name in renders['Page']]
+            st.dataframe(renders, use_container_width=True)
+            
+            st.subheader("Storage Writes")
+            writes = registry.write_bytes.summary()
+            st.dataframe(pd.DataFrame({
+                'Kind': [row['kind'] for row in writes],
+                'Writes': [row['count'] for row in writes],
+                'Mean (KiB)': [row['mean'] / 1024 for row in writes],
+                'Max (KiB)': [row['max'] / 1024 for row in writes]
+            }), use_container_width=True)
+            
+            cache = library.user_cache
+            st.caption(f"Per-user page cache: {cache.hits} hits, {cache.misses} misses, "
+                       f"{len(cache.entries)} users cached")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button("Download Prometheus metrics", registry.render(),
+                                   file_name="metrics.txt", mime="text/plain")
+            with col2:
+                if st.button("Reset Metrics"):
+                    registry.reset()
+                    st.rerun()
+        else:
+            st.error("❌ Admin access only. Please login as admin.")
+    
+    # Reruns that end in st.rerun() stop before this point and are not timed
+    metrics.record_page_render(page, time.perf_counter() - render_start)
@@ -0,0 +1,218 @@
+"""Salted password hashes and signed session tokens for the web UI.
+
+Usage:
+    python auth.py set-password alice
+"""
+import argparse
+import base64
+import getpass
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from storage import FileLock, file_signature, write_atomic
+
+DEFAULT_USERS = {'admin': 'admin123', 'user1': 'pass123', 'user2': 'pass123'}
+PBKDF2_ITERATIONS = 200_000
+
+
+def hash_password(password: str, salt: bytes, iterations: int = PBKDF2_ITERATIONS) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+class CredentialStore:
+    """Users with PBKDF2 password hashes, plus HMAC-signed session tokens.
+
+    Passwords are checked in constant time, and unknown users cost the
+    same hash as known ones. A login returns a token that resumes the
+    session without the password for ``token_ttl`` seconds. Verified
+    tokens are cached, so reconnecting sessions don't redo any hashing.
+    The signing key comes from LMS_SECRET_KEY or ``<path>.key``.
+
+    Tokens carry the user's generation, which a password change bumps, so
+    changing a password ends every session of that user. Logged-out tokens
+    are kept in the users file until they expire, so they stay revoked
+    across restarts and in every process sharing the file. Processes
+    read, change and rewrite the file under ``<path>.lock``.
+    """
+
+    def __init__(self, path: str = 'users.json', token_ttl: int = 7 * 24 * 3600, max_cached_tokens: int = 10000):
+        self.path = path
+        self.token_ttl = token_ttl
+        self.max_cached_tokens = max_cached_tokens
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(f"{path}.lock")
+        self._users: Dict[str, Dict] = {}
+        self._revoked: Dict[str, int] = {}  # nonce -> expiry of a logged-out token
+        self._known = None
+        self._load_users()
+        self._key = self._load_key()
+        self._dummy = self._new_entry(secrets.token_hex(16))  # Hashed for unknown users
+        self._verified: OrderedDict = OrderedDict()  # token -> (username, expires)
+
+    def verify_password(self, username: str, password: str) -> bool:
+        """True if password is username's; takes as long for unknown users"""
+        with self._lock:
+            entry = self._users.get(username, self._dummy)
+        digest = hash_password(password, bytes.fromhex(entry['salt']), entry['iterations'])
+        return hmac.compare_digest(digest.hex(), entry['hash']) and username in self._users
+
+    def set_password(self, username: str, password: str):
+        """Create a user or change their password, ending all of their sessions"""
+        entry = self._new_entry(password)
+        with self._lock, self._file_lock:
+            self._reload_if_changed()
+            old = self._users.get(username)
+            entry['generation'] = old.get('generation', 0) + 1 if old else 0
+            self._users[username] = entry
+            self._verified = OrderedDict(
+                (token, cached) for token, cached in self._verified.items() if cached[0] != username)
+            self._save_users()
+
+    def issue_token(self, username: str) -> str:
+        """Signed token naming username, valid for token_ttl seconds"""
+        with self._lock:
+            generation = self._users.get(username, {}).get('generation', 0)
+        claims = [username, int(time.time()) + self.token_ttl, secrets.token_hex(8), generation]
+        payload = _b64encode(json.dumps(claims).encode('utf-8'))
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify_token(self, token: Optional[str]) -> Optional[str]:
+        """Username of a valid, unexpired token, or None"""
+        if not token:
+            return None
+        now = time.time()
+        with self._lock:
+            # Another process may have changed a password or logged a token out
+            self._reload_if_changed()
+            cached = self._verified.get(token)
+            if cached is not None:
+                self._verified.move_to_end(token)
+                if cached[1] > now:
+                    return cached[0]
+                del self._verified[token]
+                return None
+
+        claims = self._check_token(token)
+        if claims is None:
+            return None
+        username, expires, nonce, generation = claims
+        if expires <= now:
+            return None
+        with self._lock:
+            entry = self._users.get(username)
+            if entry is None or entry.get('generation', 0) != generation or nonce in self._revoked:
+                return None
+            self._verified[token] = (username, expires)
+            if len(self._verified) > self.max_cached_tokens:
+                self._verified.popitem(last=False)
+        return username
+
+    def revoke_token(self, token: Optional[str]):
+        """Stop a token from resuming its session, here and after restarts (logout)"""
+        claims = self._check_token(token) if token else None
+        if claims is None:
+            return
+        _, expires, nonce, _ = claims
+        now = time.time()
+        with self._lock, self._file_lock:
+            self._reload_if_changed()
+            self._verified.pop(token, None)
+            # Expired tokens are rejected anyway; only live ones need remembering
+            self._revoked = {revoked: until for revoked, until in self._revoked.items() if until > now}
+            if expires > now:
+                self._revoked[nonce] = expires
+            self._save_users()
+
+    def _check_token(self, token: str) -> Optional[Tuple[str, int, str, int]]:
+        """The claims of a token signed with our key, or None"""
+        payload, _, signature = token.partition('.')
+        try:
+            if not hmac.compare_digest(self._sign(payload), signature):
+                return None
+            username, expires, nonce, generation = json.loads(_b64decode(payload))
+        except (TypeError, ValueError):
+            # Not ASCII, not base64 or not our claims: a forged, mangled or outdated token
+            return None
+        return username, expires, nonce, generation
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._key, payload.encode('ascii'), hashlib.sha256).digest())
+
+    @staticmethod
+    def _new_entry(password: str) -> Dict:
+        salt = secrets.token_bytes(16)
+        return {'salt': salt.hex(), 'hash': hash_password(password, salt).hex(), 'iterations': PBKDF2_ITERATIONS}
+
+    def _load_users(self):
+        with self._file_lock:
+            if not os.path.exists(self.path):
+                # First run: hash the demo accounts so the login page keeps working
+                self._users = {username: self._new_entry(password) for username, password in DEFAULT_USERS.items()}
+                self._save_users()
+                return
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+            self._known = file_signature(self.path)
+        if isinstance(stored.get('version'), int):
+            self._users, self._revoked = stored['users'], stored['revoked']
+        else:
+            # Older files hold only the users
+            self._users, self._revoked = stored, {}
+
+    def _reload_if_changed(self):
+        if file_signature(self.path) != self._known:
+            self._load_users()
+            self._verified.clear()
+
+    def _save_users(self):
+        write_atomic(self.path, json.dumps({'version': 2, 'users': self._users, 'revoked': self._revoked}, indent=4))
+        self._known = file_signature(self.path)
+
+    def _load_key(self) -> bytes:
+        if os.environ.get('LMS_SECRET_KEY'):
+            return os.environ['LMS_SECRET_KEY'].encode('utf-8')
+        key_path = f"{self.path}.key"
+        with self._file_lock:
+            # Under the lock, so processes starting together agree on one key
+            if not os.path.exists(key_path):
+                fd = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(secrets.token_bytes(32))
+            with open(key_path, 'rb') as f:
+                return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', default='users.json', help='Credential file')
+    commands = parser.add_subparsers(dest='command', required=True)
+    set_password = commands.add_parser('set-password', help='Create a user or change their password')
+    set_password.add_argument('username')
+    args = parser.parse_args()
+
+    password = getpass.getpass(f"Password for {args.username}: ")
+    if password != getpass.getpass("Repeat password: "):
+        print("Passwords do not match.")
+        sys.exit(1)
+    CredentialStore(args.users).set_password(args.username, password)
+    print(f"Password set for '{args.username}'.")
+
+
+if __name__ == "__main__":
+    main()
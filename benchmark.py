@@ -0,0 +1,438 @@
+"""Benchmarks for the library backend.
+
+Usage:
+    python benchmark.py concurrency --storage journal --workers 1 2 4 8
+    python benchmark.py import --storage journal sqlite --titles 100000
+    python benchmark.py operations --storage json sqlite --scales 1000 100000
+    python benchmark.py mixed --storage journal --threads 1 4 16 --seconds 10
+    python benchmark.py generate library_data.json --books 100000 --loans 100000
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import queue
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from code import Library
+from storage import BookRecord, LoanRecord, open_storage
+
+BENCH_BOOK = 'Benchmark Book'
+
+
+def _checkout_worker(data_file: str, storage: str, worker: int, checkouts: int, results):
+    """Issue `checkouts` copies from a private Library instance"""
+    library = Library(data_file, storage=storage)
+    issued = 0
+    for i in range(checkouts):
+        success, _ = library.issue_book(f"worker{worker}_reader{i}", BENCH_BOOK)
+        issued += success
+    library.close()
+    results.put(issued)
+
+
+def run_concurrency(storage: str, workers: int, checkouts: int, mode: str) -> Dict:
+    """Race `workers` sessions for a book with fewer copies than requests.
+
+    Afterwards the data on disk must show exactly as many loans as there
+    were successful checkouts, and never more than the copies available.
+    A worker that crashes makes the run inconsistent.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, 'library_data.json')
+        copies = workers * checkouts // 2
+        setup = Library(data_file, storage=storage)
+        setup.add_new_book(BENCH_BOOK, copies)
+        setup.close()
+
+        start = time.perf_counter()
+        if mode == 'threads':
+            # Streamlit sessions share one Library per process
+            library = Library(data_file, storage=storage)
+            counts = []
+
+            def session(worker):
+                issued = 0
+                for i in range(checkouts):
+                    success, _ = library.issue_book(f"worker{worker}_reader{i}", BENCH_BOOK)
+                    issued += success
+                counts.append(issued)
+
+            threads = [threading.Thread(target=session, args=(w,)) for w in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            library.close()
+        else:
+            results = multiprocessing.Queue()
+            processes = [multiprocessing.Process(target=_checkout_worker,
+                                                 args=(data_file, storage, w, checkouts, results))
+                         for w in range(workers)]
+            for process in processes:
+                process.start()
+            counts = []
+            while len(counts) < workers:
+                try:
+                    counts.append(results.get(timeout=1))
+                except queue.Empty:
+                    # A worker that died never reports; stop waiting once the rest have
+                    crashed = sum(1 for process in processes if process.exitcode not in (None, 0))
+                    if len(counts) + crashed >= workers:
+                        break
+            for process in processes:
+                process.join()
+        elapsed = time.perf_counter() - start
+
+        check = Library(data_file, storage=storage)
+        loans = sum(1 for loan in check.data['issued_books'].values() if loan['book'] == BENCH_BOOK)
+        available = check.data['books'][BENCH_BOOK]['available_copies']
+        check.close()
+
+    successes = sum(counts)
+    crashed = workers - len(counts)
+    return {
+        'storage': storage,
+        'mode': mode,
+        'workers': workers,
+        'attempts': workers * checkouts,
+        'copies': copies,
+        'successful_checkouts': successes,
+        'loans_on_disk': loans,
+        'available_on_disk': available,
+        'crashed_workers': crashed,
+        'consistent': crashed == 0 and successes == loans == copies and available == 0,
+        'seconds': round(elapsed, 4),
+        'attempts_per_second': round(workers * checkouts / elapsed, 1),
+    }
+
+
+def concurrency_command(args) -> List[Dict]:
+    results = []
+    for storage in args.storage:
+        for mode in args.mode:
+            for workers in args.workers:
+                results.append(run_concurrency(storage, workers, args.checkouts, mode))
+    return results
+
+
+def write_synthetic_catalog(path: str, titles: int, duplicate_ratio: float = 0.1, seed: int = 0):
+    """Write a CSV catalog where roughly duplicate_ratio of the rows repeat an earlier title"""
+    rng = random.Random(seed)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['title', 'copies'])
+        for i in range(titles):
+            if i and rng.random() < duplicate_ratio:
+                title = f"Synthetic Title {rng.randrange(i):07d}"
+            else:
+                title = f"Synthetic Title {i:07d}"
+            writer.writerow([title, rng.randint(1, 5)])
+
+
+def run_import(storage: str, catalog: str, chunk_size: int) -> Dict:
+    """Import a catalog file into an empty library and time it"""
+    with tempfile.TemporaryDirectory() as tmp:
+        library = Library(os.path.join(tmp, 'library_data.json'), storage=storage)
+        start = time.perf_counter()
+        summary = library.import_catalog(catalog, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+        titles = len(library.data['books'])
+        library.close()
+
+    return {
+        'storage': storage,
+        'chunk_size': chunk_size,
+        'rows': summary['rows'],
+        'titles_in_library': titles,
+        'seconds': round(elapsed, 4),
+        'rows_per_second': round(summary['rows'] / elapsed, 1),
+    }
+
+
+def import_command(args) -> List[Dict]:
+    with tempfile.TemporaryDirectory() as tmp:
+        catalog = os.path.join(tmp, 'catalog.csv')
+        write_synthetic_catalog(catalog, args.titles)
+        return [run_import(storage, catalog, chunk_size)
+                for storage in args.storage for chunk_size in args.chunk_size]
+
+
+def generate_library(path: str, storage: str, books: int, loans: int, users: int = 0, seed: int = 0) -> Dict:
+    """Write a synthetic library of `books` titles and `loans` open loans; returns its data.
+
+    Loans go to `users` readers (default: one per ten loans) and are due
+    between 30 days ago and 15 days from now, so about two thirds are overdue.
+    """
+    rng = random.Random(seed)
+    users = users or max(1, loans // 10)
+    copies = [rng.randint(1, 5) for _ in range(books)]
+    titles = [f"Synthetic Title {i:07d}" for i in range(books)]
+    # Enough extra copies that every loan finds one
+    for _ in range(max(0, loans - sum(copies))):
+        copies[rng.randrange(books)] += 1
+
+    available = list(copies)
+    with_copies = list(range(books))
+    issued = {}
+    now = datetime.now()
+    for loan_id in range(1, loans + 1):
+        while True:
+            slot = rng.randrange(len(with_copies))
+            book = with_copies[slot]
+            if available[book]:
+                break
+            with_copies[slot] = with_copies[-1]
+            with_copies.pop()
+        available[book] -= 1
+        issued_at = now - timedelta(days=rng.randint(0, 45), seconds=rng.randrange(86400))
+        issued[str(loan_id)] = LoanRecord(f"reader{rng.randrange(users):06d}", titles[book],
+                                          issued_at.strftime('%Y-%m-%d %H:%M:%S'),
+                                          (issued_at + timedelta(days=15)).strftime('%Y-%m-%d'))
+
+    data = {
+        'books': {title: BookRecord(total, free) for title, total, free in zip(titles, copies, available)},
+        'issued_books': issued,
+        'loan_seq': loans,
+    }
+    writer = open_storage(storage, path)
+    with writer.lock:
+        writer.save(data)
+    writer.close()
+    return data
+
+
+def _timings(samples: List[float]) -> Dict:
+    """Summary of a list of durations in seconds, in milliseconds"""
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 4),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 4),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+        'max_ms': round(ordered[-1] * 1000, 4),
+    }
+
+
+def _time_calls(func: Callable, arguments: List) -> Dict:
+    samples = []
+    for argument in arguments:
+        start = time.perf_counter()
+        func(argument)
+        samples.append(time.perf_counter() - start)
+    return _timings(samples)
+
+
+def run_operations(storage: str, scale: int, repeat: int, seed: int = 0) -> Dict:
+    """Time the main Library operations on a synthetic library with `scale` books and loans"""
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, 'library_data.json')
+        data = generate_library(data_file, storage, scale, scale, seed=seed)
+        users = sorted({loan['user'] for loan in data['issued_books'].values()})
+        titles = list(data['books'])
+        del data
+
+        def load(_):
+            Library(data_file, storage=storage).close()
+
+        def dashboard(_):
+            # A fresh instance, so the derived totals and indexes are built from scratch
+            library = Library(data_file, storage=storage)
+            start = time.perf_counter()
+            library.get_stats()
+            library.get_user_stats(users[0])
+            cold.append(time.perf_counter() - start)
+            library.close()
+
+        results = {'storage': storage, 'books': scale, 'loans': scale,
+                   'load': _time_calls(load, range(repeat))}
+        cold = []
+        for _ in range(repeat):
+            dashboard(None)
+        results['dashboard_cold'] = _timings(cold)
+
+        library = Library(data_file, storage=storage)
+        results['dashboard'] = _time_calls(
+            lambda user: (library.get_stats(), library.get_user_stats(user)),
+            [rng.choice(users) for _ in range(repeat * 10)])
+        results['user_lookup'] = _time_calls(library.get_user_borrowed_books,
+                                             [rng.choice(users) for _ in range(repeat * 10)])
+        results['overdue_listing'] = _time_calls(lambda _: library.get_overdue_books(), range(repeat))
+        results['issue'] = _time_calls(lambda title: library.issue_book('benchmark_reader', title),
+                                       [rng.choice(titles) for _ in range(repeat * 10)])
+        returns = list(library.find_loans(user='benchmark_reader'))
+        results['return'] = _time_calls(library.return_book, returns)
+        results['save'] = _time_calls(lambda _: library.save_data(), range(repeat))
+        library.close()
+    return results
+
+
+def operations_command(args) -> List[Dict]:
+    return [run_operations(storage, scale, args.repeat, args.seed)
+            for scale in args.scales for storage in args.storage]
+
+
+def run_mixed(storage: str, scale: int, threads: int, seconds: float, seed: int = 0,
+              write_behind: bool = False) -> Dict:
+    """Many sessions sharing one Library, as Streamlit runs them.
+
+    Each thread loops over a mix of 70% reads (dashboard, "my books", a
+    catalog page), 20% issues and 10% returns until time runs out. At the
+    end every title's available copies must match its open loans.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        data_file = os.path.join(tmp, 'library_data.json')
+        data = generate_library(data_file, storage, scale, scale // 2, seed=seed)
+        users = sorted({loan['user'] for loan in data['issued_books'].values()})
+        titles = list(data['books'])
+        del data
+
+        library = Library(data_file, storage=storage, write_behind=write_behind)
+        samples: Dict[str, List[float]] = {'read': [], 'issue': [], 'return': []}
+        failures = []
+        deadline = time.perf_counter() + seconds
+
+        def session(worker: int):
+            rng = random.Random(seed + worker)
+            user = f"mixed_reader{worker}"
+            own_loans = []
+            local = {'read': [], 'issue': [], 'return': []}
+            try:
+                while time.perf_counter() < deadline:
+                    roll = rng.random()
+                    start = time.perf_counter()
+                    if roll < 0.7:
+                        library.refresh()
+                        library.get_stats()
+                        library.get_user_borrowed_books(rng.choice(users))
+                        library.query_books(offset=rng.randrange(max(1, scale - 25)), limit=25)
+                        kind = 'read'
+                    elif roll < 0.9 or not own_loans:
+                        library.issue_book(user, rng.choice(titles))
+                        own_loans = list(library.find_loans(user=user))
+                        kind = 'issue'
+                    else:
+                        library.return_book(own_loans.pop())
+                        kind = 'return'
+                    local[kind].append(time.perf_counter() - start)
+            except Exception as e:
+                failures.append(repr(e))
+            for kind, durations in local.items():
+                samples[kind].extend(durations)
+
+        workers = [threading.Thread(target=session, args=(w,)) for w in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        library.close()
+
+        check = Library(data_file, storage=storage)
+        loans_per_book = {}
+        for loan in check.data['issued_books'].values():
+            loans_per_book[loan['book']] = loans_per_book.get(loan['book'], 0) + 1
+        consistent = not failures and all(
+            info['total_copies'] - info['available_copies'] == loans_per_book.get(title, 0)
+            for title, info in check.data['books'].items())
+        check.close()
+
+    operations = sum(len(durations) for durations in samples.values())
+    return {
+        'storage': storage,
+        'write_behind': write_behind,
+        'books': scale,
+        'threads': threads,
+        'seconds': round(elapsed, 4),
+        'operations': operations,
+        'operations_per_second': round(operations / elapsed, 1),
+        'consistent': consistent,
+        'errors': failures,
+        **{kind: _timings(durations) for kind, durations in samples.items() if durations},
+    }
+
+
+def mixed_command(args) -> List[Dict]:
+    return [run_mixed(storage, scale, threads, args.seconds, args.seed, args.write_behind)
+            for scale in args.scales for storage in args.storage for threads in args.threads]
+
+
+def generate_command(args) -> List[Dict]:
+    start = time.perf_counter()
+    generate_library(args.path, args.storage, args.books, args.loans, args.users, args.seed)
+    return [{'path': args.path, 'storage': args.storage, 'books': args.books, 'loans': args.loans,
+             'seconds': round(time.perf_counter() - start, 4)}]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--output', help='Write results as JSON to this file')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    concurrency = commands.add_parser('concurrency', parents=[common],
+                                      help='Concurrent checkouts against one book')
+    concurrency.add_argument('--storage', nargs='+', default=['json', 'journal', 'sqlite'])
+    concurrency.add_argument('--mode', nargs='+', default=['threads', 'processes'],
+                             choices=['threads', 'processes'])
+    concurrency.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4, 8])
+    concurrency.add_argument('--checkouts', type=int, default=100,
+                             help='Checkout attempts per worker')
+    concurrency.set_defaults(run=concurrency_command)
+
+    catalog_import = commands.add_parser('import', parents=[common],
+                                         help='Bulk catalog import throughput')
+    catalog_import.add_argument('--storage', nargs='+', default=['json', 'journal', 'sqlite'])
+    catalog_import.add_argument('--titles', type=int, default=100000, help='Rows in the synthetic catalog')
+    catalog_import.add_argument('--chunk-size', nargs='+', type=int, default=[1000, 10000])
+    catalog_import.set_defaults(run=import_command)
+
+    operations = commands.add_parser('operations', parents=[common],
+                                     help='Time load, save, issue, return and lookups at several scales')
+    operations.add_argument('--storage', nargs='+', default=['json', 'journal', 'sqlite', 'binary'])
+    operations.add_argument('--scales', nargs='+', type=int, default=[1000, 100000],
+                            help='Books (and open loans) in each synthetic library')
+    operations.add_argument('--repeat', type=int, default=5, help='Runs of the slow operations per scale')
+    operations.add_argument('--seed', type=int, default=0)
+    operations.set_defaults(run=operations_command)
+
+    mixed = commands.add_parser('mixed', parents=[common],
+                                help='Threads mixing reads, issues and returns on one Library')
+    mixed.add_argument('--storage', nargs='+', default=['json', 'journal', 'sqlite', 'binary'])
+    mixed.add_argument('--scales', nargs='+', type=int, default=[10000])
+    mixed.add_argument('--threads', nargs='+', type=int, default=[1, 4, 16])
+    mixed.add_argument('--seconds', type=float, default=5.0, help='Duration of each run')
+    mixed.add_argument('--seed', type=int, default=0)
+    mixed.add_argument('--write-behind', action='store_true', help='Queue commits for a writer thread')
+    mixed.set_defaults(run=mixed_command)
+
+    generate = commands.add_parser('generate', parents=[common],
+                                   help='Write a synthetic library for manual testing')
+    generate.add_argument('path', help='Data file to create')
+    generate.add_argument('--storage', default='json')
+    generate.add_argument('--books', type=int, default=100000)
+    generate.add_argument('--loans', type=int, default=100000)
+    generate.add_argument('--users', type=int, default=0, help='Distinct readers (default: loans / 10)')
+    generate.add_argument('--seed', type=int, default=0)
+    generate.set_defaults(run=generate_command)
+
+    args = parser.parse_args()
+    results = args.run(args)
+    text = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
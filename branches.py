@@ -0,0 +1,140 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from code import Library
+
+BRANCH_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]*$')
+
+
+class BranchLibrary:
+    """One Library shard per branch, with queries fanned out across all of them.
+
+    Each branch keeps its books and loans in its own data file, derived
+    from ``data_file``: ``library_data.json`` becomes
+    ``library_data_<branch>.json`` (or the matching ``.db`` / ``.bin``),
+    with its own lock file, journal and history. Writes go to the one
+    shard that owns the branch, so they never lock or rewrite another
+    branch's data. Read-only lookups run on every shard in parallel on a
+    thread pool and the per-branch results are merged.
+    """
+
+    def __init__(self, branches: List[str], data_file='library_data.json', storage='json',
+                 write_behind=False, max_workers: Optional[int] = None):
+        self.data_file = data_file
+        self.storage = storage
+        self.write_behind = write_behind
+        self.libraries: Dict[str, Library] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers or max(len(branches), 1),
+                                        thread_name_prefix='branch-query')
+        for branch in branches:
+            self.add_branch(branch)
+
+    def shard_file(self, branch: str) -> str:
+        """Data file of one branch's shard"""
+        root, ext = os.path.splitext(self.data_file)
+        return f"{root}_{branch}{ext}"
+
+    def add_branch(self, branch: str) -> Library:
+        """Open (or create) the shard of a branch"""
+        if not BRANCH_NAME.match(branch):
+            raise ValueError(f"Invalid branch name '{branch}': use letters, digits, '-' and '_'.")
+        with self._lock:
+            if branch not in self.libraries:
+                self.libraries[branch] = Library(self.shard_file(branch), storage=self.storage,
+                                                 write_behind=self.write_behind)
+            return self.libraries[branch]
+
+    @property
+    def branches(self) -> List[str]:
+        return sorted(self.libraries)
+
+    def branch(self, branch: str) -> Library:
+        """The Library of one branch"""
+        library = self.libraries.get(branch)
+        if library is None:
+            raise KeyError(f"Unknown branch '{branch}'.")
+        return library
+
+    def fan_out(self, query: Callable[[Library], object]) -> Dict[str, object]:
+        """Run query on every branch's Library in parallel; results keyed by branch"""
+        with self._lock:
+            libraries = dict(self.libraries)
+        futures = {branch: self._pool.submit(self._run, library, query) for branch, library in libraries.items()}
+        return {branch: future.result() for branch, future in sorted(futures.items())}
+
+    @staticmethod
+    def _run(library: Library, query: Callable[[Library], object]):
+        # Each shard catches up with its own file; no other shard is touched
+        library.refresh()
+        return query(library)
+
+    def find_book(self, book_name: str) -> Dict[str, Dict]:
+        """Copies of one title at each branch that stocks it"""
+        found = self.fan_out(lambda library: library.get_book_copies(book_name))
+        return {branch: copies for branch, copies in found.items() if copies is not None}
+
+    def get_available_books(self) -> Dict[str, Dict]:
+        """Titles with a copy available anywhere, totals summed and per-branch availability"""
+        merged = {}
+        for branch, available in self.fan_out(lambda library: library.get_available_books()).items():
+            for book, info in available.items():
+                entry = merged.get(book)
+                if entry is None:
+                    entry = merged[book] = {'total_copies': 0, 'available_copies': 0, 'branches': {}}
+                entry['total_copies'] += info['total_copies']
+                entry['available_copies'] += info['available_copies']
+                entry['branches'][branch] = info['available_copies']
+        return merged
+
+    def search_books(self, query: str, limit: int = 10, available_only: bool = False,
+                     fuzzy: bool = True) -> List[Tuple[str, List[str]]]:
+        """Best matching titles across branches, each with the branches holding it"""
+        ranked = self.fan_out(lambda library: library.search_books(query, limit, available_only, fuzzy))
+        best_rank, holders = {}, {}
+        for branch, titles in ranked.items():
+            for rank, title in enumerate(titles):
+                best_rank[title] = min(rank, best_rank.get(title, rank))
+                holders.setdefault(title, []).append(branch)
+        titles = sorted(best_rank, key=lambda title: (best_rank[title], -len(holders[title]), title))
+        return [(title, holders[title]) for title in titles[:limit]]
+
+    def get_stats(self) -> Dict:
+        """Network-wide dashboard totals, summed over branches"""
+        totals = {}
+        for stats in self.fan_out(lambda library: library.get_stats()).values():
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def get_user_borrowed_books(self, user: str) -> List[Dict]:
+        """A user's loans at every branch; transaction IDs are only unique within a branch"""
+        loans = []
+        for branch, books in self.fan_out(lambda library: library.get_user_borrowed_books(user)).items():
+            loans.extend(dict(book, branch=branch) for book in books)
+        return loans
+
+    def issue_book(self, branch: str, user: str, book_name: str, wait: bool = False) -> Tuple[bool, str]:
+        """Issue a book from one branch's stock"""
+        return self.branch(branch).issue_book(user, book_name, wait)
+
+    def return_book(self, branch: str, transaction_id: str, wait: bool = False) -> Tuple[bool, str]:
+        """Return a loan to the branch that issued it"""
+        return self.branch(branch).return_book(transaction_id, wait)
+
+    def add_new_book(self, branch: str, book_name: str, copies: int, wait: bool = False) -> Tuple[bool, str]:
+        """Add a title to one branch's catalog"""
+        return self.branch(branch).add_new_book(book_name, copies, wait)
+
+    def flush(self):
+        for library in self.libraries.values():
+            library.flush()
+
+    def close(self):
+        """Write out queued changes of every branch and stop the query pool"""
+        self._pool.shutdown()
+        for library in self.libraries.values():
+            library.close()
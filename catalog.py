@@ -0,0 +1,78 @@
+import csv
+import io
+import json
+import os
+from itertools import islice
+from typing import IO, Iterator, List, Optional, Tuple, Union
+
+CATALOG_FORMATS = ('csv', 'jsonl')
+TITLE_FIELDS = ('title', 'book', 'book_name', 'Book Name')
+COPIES_FIELDS = ('copies', 'total_copies', 'Total Copies')
+
+
+def detect_format(name: str) -> str:
+    """Guess the catalog format from a file name"""
+    extension = os.path.splitext(name)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension == '.csv':
+        return 'csv'
+    raise ValueError(f"Cannot tell the format of '{name}'. Use a .csv or .jsonl file.")
+
+
+def read_catalog(source: Union[str, IO], fmt: Optional[str] = None) -> Iterator[Optional[Tuple[str, int]]]:
+    """Stream (title, copies) rows from a CSV or JSON Lines catalog.
+
+    source is a path or an open text or binary file. Rows without a title
+    or with an invalid copy count come out as None so callers can count
+    them. A missing copy count means one copy.
+    """
+    if isinstance(source, str):
+        fmt = fmt or detect_format(source)
+        with open(source, 'r', encoding='utf-8-sig', newline='') as f:
+            yield from read_catalog(f, fmt)
+        return
+
+    if fmt not in CATALOG_FORMATS:
+        raise ValueError(f"Unknown catalog format '{fmt}'. Choose from: {', '.join(CATALOG_FORMATS)}")
+    if isinstance(source.read(0), bytes):
+        source = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+
+    if fmt == 'csv':
+        rows = csv.DictReader(source)
+    else:
+        rows = (_parse_json_line(line) for line in source if line.strip())
+    for row in rows:
+        yield _catalog_entry(row)
+
+
+def read_chunks(rows: Iterator, chunk_size: int) -> Iterator[List]:
+    """Group a row stream into lists of at most chunk_size rows"""
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _parse_json_line(line: str):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+def _catalog_entry(row) -> Optional[Tuple[str, int]]:
+    if not isinstance(row, dict):
+        return None
+    title = next((row[field] for field in TITLE_FIELDS if row.get(field)), None)
+    if not isinstance(title, str) or not title.strip():
+        return None
+    copies = next((row[field] for field in COPIES_FIELDS if row.get(field) not in (None, '')), 1)
+    try:
+        copies = int(copies)
+    except (TypeError, ValueError):
+        return None
+    if copies < 1:
+        return None
+    return title.strip(), copies
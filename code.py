@@ -1,25 +1,192 @@
-import json
-import os
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
+from itertools import islice
+from typing import IO, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from catalog import read_catalog, read_chunks
+from history import CirculationHistory
+from metrics import timed
+from search import TitleIndex
+from storage import WriteBehindStorage, apply_record, compact_data, open_storage
+
+class LoanIndex:
+    """Secondary indexes over open loans: by user, by book and by due date"""
+    
+    def __init__(self, issued_books: Dict[str, Dict]):
+        # Dicts keyed by transaction id act as insertion-ordered sets
+        self.by_user: Dict[str, Dict[str, None]] = {}
+        self.by_book: Dict[str, Dict[str, None]] = {}
+        self.by_due_date: Dict[str, Dict[str, None]] = {}
+        self.due_dates: List[str] = []  # Sorted distinct due dates
+        for trans_id, details in issued_books.items():
+            self.add(trans_id, details)
+    
+    def add(self, trans_id: str, details: Dict):
+        self.by_user.setdefault(details['user'], {})[trans_id] = None
+        self.by_book.setdefault(details['book'], {})[trans_id] = None
+        due_date = details['due_date']
+        if due_date not in self.by_due_date:
+            self.by_due_date[due_date] = {}
+            insort(self.due_dates, due_date)
+        self.by_due_date[due_date][trans_id] = None
+    
+    def remove(self, trans_id: str, details: Dict):
+        self._discard(self.by_user, details['user'], trans_id)
+        self._discard(self.by_book, details['book'], trans_id)
+        due_date = details['due_date']
+        if self._discard(self.by_due_date, due_date, trans_id):
+            del self.due_dates[bisect_left(self.due_dates, due_date)]
+    
+    def due_before(self, due_date: str) -> Iterator[str]:
+        """Transaction ids of loans due strictly before due_date, earliest first"""
+        for date in self.due_dates[:bisect_left(self.due_dates, due_date)]:
+            yield from self.by_due_date[date]
+    
+    def count_due_before(self, due_date: str) -> int:
+        """Number of loans due strictly before due_date"""
+        return sum(len(self.by_due_date[date])
+                   for date in self.due_dates[:bisect_left(self.due_dates, due_date)])
+    
+    @staticmethod
+    def _discard(index: Dict[str, Dict[str, None]], key: str, trans_id: str) -> bool:
+        """Remove trans_id from index[key]; True if that emptied the key"""
+        ids = index.get(key)
+        if ids is None:
+            return False
+        ids.pop(trans_id, None)
+        if not ids:
+            del index[key]
+            return True
+        return False
+
+
+class LibraryStats:
+    """Running catalog totals for the dashboard, updated in O(1) per record"""
+    
+    def __init__(self, books: Dict[str, Dict]):
+        self.titles = len(books)
+        self.total_copies = sum(info['total_copies'] for info in books.values())
+        self.available_copies = sum(info['available_copies'] for info in books.values())
+    
+    def apply(self, record: Dict):
+        op = record['op']
+        if op == 'issue':
+            self.available_copies -= 1
+        elif op == 'return':
+            self.available_copies += 1
+        elif op == 'add':
+            self.titles += 1
+            self.total_copies += record['copies']
+            self.available_copies += record['copies']
+        elif op == 'restock':
+            self.total_copies += record['copies']
+            self.available_copies += record['copies']
+
+
+class CatalogColumns:
+    """Column arrays over the catalog for paged queries, patched in place per loan"""
+    
+    def __init__(self, books: Dict[str, Dict]):
+        count = len(books)
+        self.titles = np.array(list(books), dtype=object)
+        self.total_copies = np.fromiter((info['total_copies'] for info in books.values()), np.int64, count)
+        self.available_copies = np.fromiter((info['available_copies'] for info in books.values()), np.int64, count)
+        self.position = {title: i for i, title in enumerate(books)}
+        self.title_order = np.argsort(self.titles, kind='stable')
+        self._lowered = None
+    
+    def apply(self, record: Dict, details: Dict) -> bool:
+        """Patch the arrays for one record; False if they need a rebuild instead"""
+        op = record['op']
+        if op == 'issue':
+            self.available_copies[self.position[record['book']]] -= 1
+        elif op == 'return':
+            self.available_copies[self.position[details['book']]] += 1
+        elif op == 'restock':
+            position = self.position[record['book']]
+            self.total_copies[position] += record['copies']
+            self.available_copies[position] += record['copies']
+        elif op == 'add':
+            return False
+        return True
+    
+    def matching(self, name_filter: str) -> np.ndarray:
+        """Boolean mask of titles containing name_filter, ignoring case"""
+        if self._lowered is None:
+            self._lowered = [title.lower() for title in self.titles]
+        needle = name_filter.lower()
+        return np.fromiter((needle in title for title in self._lowered), bool, len(self._lowered))
+
+
+class UserViewCache:
+    """Least-recently-used cache of per-user page data.
+    
+    Entries belong to a user and are dropped when one of that user's loans
+    changes. Each is also stamped with the day it was computed, because
+    days remaining and overdue flags move with the date.
+    """
+    
+    def __init__(self, max_users: int):
+        self.max_users = max_users
+        self.entries: OrderedDict = OrderedDict()  # user -> {view: (day, value)}
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, user: str, view: str, day: str, compute: Callable):
+        views = self.entries.get(user)
+        if views is not None:
+            self.entries.move_to_end(user)
+            cached = views.get(view)
+            if cached is not None and cached[0] == day:
+                self.hits += 1
+                return cached[1]
+        else:
+            views = self.entries[user] = {}
+            if len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+        self.misses += 1
+        value = compute()
+        views[view] = (day, value)
+        return value
+    
+    def invalidate(self, user: str):
+        self.entries.pop(user, None)
+    
+    def clear(self):
+        self.entries.clear()
+
 
 class Library:
     """Advanced Library Management System with multiple copies support"""
     
-    def __init__(self, data_file='library_data.json'):
+    def __init__(self, data_file='library_data.json', storage='json', write_behind=False):
         self.data_file = data_file
         self.max_borrow_days = 15
+        self.user_cache = UserViewCache(max_users=1024)
+        self.lock = threading.RLock()
+        self.history = CirculationHistory(f"{data_file}.history")
+        self.storage = open_storage(storage, data_file)
+        if write_behind:
+            # Commits return once applied in memory; a writer thread persists them
+            self.storage = WriteBehindStorage(self.storage, self.lock)
+        self._listeners = []
         self.data = self.load_data()
+        self._reset_views()
         
+    @timed('load_data')
     def load_data(self) -> Dict:
-        """Load library data from JSON file or initialize empty structure"""
-        if os.path.exists(self.data_file):
-            try:
-                with open(self.data_file, 'r') as f:
-                    return json.load(f)
-            except:
-                return self.initialize_default_data()
-        return self.initialize_default_data()
+        """Load library data from storage or initialize empty structure"""
+        with self.storage.lock:
+            data = self.storage.load()
+        if data is None:
+            return compact_data(self.initialize_default_data())
+        return data
     
     def initialize_default_data(self) -> Dict:
         """Initialize default library data"""
@@ -32,26 +199,333 @@ class Library:
                 'The Catcher in the Rye': {'total_copies': 2, 'available_copies': 2},
                 'Brave New World': {'total_copies': 3, 'available_copies': 3}
             },
-            'issued_books': {}  # Format: {transaction_id: {user, book, issue_date, due_date}}
+            'issued_books': {},  # Format: {transaction_id: {user, book, issue_date, due_date}}
+            'loan_seq': 0  # Last transaction ID handed out
         }
     
+    def refresh(self) -> bool:
+        """Pick up changes committed outside this instance, if there are any"""
+        if not self.storage.changed():
+            return False
+        with self.storage.lock, self.lock:
+            return self._sync()
+    
+    @contextmanager
+    def transaction(self):
+        """Hold the library exclusively, synced with other threads and processes.
+        
+        Checks made inside the block see the latest committed state and no
+        other session can commit until the block exits, so a check followed
+        by a commit cannot lose or duplicate an update.
+        """
+        # Storage lock first: a write-behind writer holds it while it writes
+        # without the library lock, so readers never wait on the disk
+        with self.storage.lock, self.lock:
+            self._sync()
+            yield self
+    
+    def _sync(self) -> bool:
+        """Apply records committed elsewhere, reloading when they can't be replayed"""
+        records = self.storage.poll()
+        if records is None:
+            self.data = self.load_data()
+            self._reset_views()
+            return True
+        for record in records:
+            self._apply(record)
+        return bool(records)
+    
+    @timed('save_data')
     def save_data(self):
-        """Save library data to JSON file"""
-        with open(self.data_file, 'w') as f:
-            json.dump(self.data, f, indent=4)
+        """Save a full copy of library data to storage"""
+        with self.storage.lock, self.lock:
+            self.storage.save(self.data)
+    
+    def commit(self, records: List[Dict]):
+        """Apply mutation records in memory and persist them"""
+        with self.storage.lock, self.lock:
+            for record in records:
+                self._apply(record)
+            self.storage.commit(self.data, records)
+    
+    def _reset_views(self):
+        """Drop derived indexes and caches; each is rebuilt from data on first use"""
+        self._loan_index = None
+        self._stats = None
+        self._loan_columns = None
+        self._catalog_columns = None
+        self._title_index = None
+        self.user_cache.clear()
+        for listener in self._listeners:
+            listener.reset()
+    
+    def add_listener(self, listener):
+        """Notify listener of loans as they are issued and returned.
+        
+        The listener needs loan_issued(trans_id, details), loan_returned(trans_id)
+        and reset(); reset means the data was reloaded and anything derived
+        from it should be rebuilt. All three run with the library lock held.
+        """
+        with self.lock:
+            self._listeners.append(listener)
+    
+    def _apply(self, record: Dict):
+        """Apply one record to the in-memory data and keep indexes and totals in step"""
+        op = record['op']
+        index = self._loan_index
+        details = None
+        if op == 'return':
+            details = self.data['issued_books'].get(record['id'])
+            if details is None:
+                return
+            if index is not None:
+                index.remove(record['id'], details)
+            self.user_cache.invalidate(details['user'])
+            for listener in self._listeners:
+                listener.loan_returned(record['id'])
+        apply_record(self.data, record)
+        if op == 'issue':
+            details = self.data['issued_books'][record['id']]
+            if index is not None:
+                index.add(record['id'], details)
+            self.user_cache.invalidate(details['user'])
+            for listener in self._listeners:
+                listener.loan_issued(record['id'], details)
+        if self._stats is not None:
+            self._stats.apply(record)
+        if op in ('issue', 'return'):
+            self._loan_columns = None
+        if self._catalog_columns is not None and not self._catalog_columns.apply(record, details):
+            self._catalog_columns = None
+        if self._title_index is not None and op == 'add':
+            self._title_index.add(record['book'])
+    
+    @property
+    def loan_index(self) -> LoanIndex:
+        """Loan indexes, built on first use and then maintained incrementally"""
+        with self.lock:
+            if self._loan_index is None:
+                self._loan_index = LoanIndex(self.data['issued_books'])
+            return self._loan_index
+    
+    @property
+    def stats(self) -> LibraryStats:
+        """Catalog totals, computed on first use and then maintained incrementally"""
+        with self.lock:
+            if self._stats is None:
+                self._stats = LibraryStats(self.data['books'])
+            return self._stats
+    
+    def get_stats(self) -> Dict:
+        """Get library-wide totals for the dashboard"""
+        with self.lock:
+            stats = self.stats
+            return {
+                'titles': stats.titles,
+                'total_copies': stats.total_copies,
+                'available_copies': stats.available_copies,
+                'issued': len(self.data['issued_books']),
+                'overdue': self.loan_index.count_due_before(self._overdue_cutoff())
+            }
+    
+    def get_user_stats(self, user: str) -> Dict:
+        """Get loan totals for a specific user"""
+        with self.lock:
+            cutoff = self._overdue_cutoff()
+            return dict(self.user_cache.get(user, 'stats', cutoff, lambda: self._user_stats(user, cutoff)))
+    
+    def _user_stats(self, user: str, cutoff: str) -> Dict:
+        loans = self.loan_index.by_user.get(user, {})
+        return {
+            'borrowed': len(loans),
+            'overdue': sum(1 for trans_id in loans
+                           if self.data['issued_books'][trans_id]['due_date'] < cutoff)
+        }
+    
+    def _overdue_cutoff(self) -> str:
+        """Due dates before this are overdue"""
+        # calculate_days_remaining already counts a loan due today as overdue
+        return (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    
+    def flush(self):
+        """Wait until every change made so far is on disk (only write-behind mode queues any)"""
+        if hasattr(self.storage, 'flush'):
+            self.storage.flush()
+    
+    def close(self):
+        """Write out queued changes and release storage resources"""
+        self.storage.close()
+        self.history.close()
     
     def get_available_books(self) -> Dict:
         """Get all available books with copy information"""
         available = {}
-        for book, info in self.data['books'].items():
-            if info['available_copies'] > 0:
-                available[book] = info
+        with self.lock:
+            for book, info in self.data['books'].items():
+                if info['available_copies'] > 0:
+                    available[book] = info
         return available
     
+    def get_book_copies(self, book_name: str) -> Optional[Dict]:
+        """Copy counts of one title, or None if the library doesn't stock it"""
+        with self.lock:
+            info = self.data['books'].get(book_name)
+            if info is None:
+                return None
+            return {'total_copies': info['total_copies'], 'available_copies': info['available_copies']}
+    
+    @timed('get_issued_books')
     def get_issued_books(self) -> List[Dict]:
         """Get all issued books with details"""
+        with self.lock:
+            return self._issued_list(self.data['issued_books'])
+    
+    def get_loans_frame(self) -> pd.DataFrame:
+        """Get all issued books as columns, with days remaining computed in one vectorized pass"""
+        with self.lock:
+            if self._loan_columns is None:
+                # Due dates are parsed once per change to the loans, not per render
+                loans = self.data['issued_books']
+                columns = pd.DataFrame({
+                    'transaction_id': list(loans),
+                    'user': [details['user'] for details in loans.values()],
+                    'book': [details['book'] for details in loans.values()],
+                    'issue_date': [details['issue_date'] for details in loans.values()],
+                    'due_date': [details['due_date'] for details in loans.values()],
+                }, dtype=str)  # Without it, no loans gives float columns the user filter can't search
+                columns['due_at'] = pd.to_datetime(columns['due_date'], format='%Y-%m-%d')
+                self._loan_columns = columns
+            columns = self._loan_columns
+        
+        # Same rounding as calculate_days_remaining: whole days, floored
+        days_remaining = (columns['due_at'].to_numpy() - np.datetime64(datetime.now())) // np.timedelta64(1, 'D')
+        return columns.assign(days_remaining=days_remaining, is_overdue=days_remaining < 0)
+    
+    def search_books(self, query: str, limit: int = 10, available_only: bool = False,
+                     fuzzy: bool = True) -> List[str]:
+        """Find the titles best matching a search query"""
+        self._build_title_index(fuzzy)
+        with self.lock:
+            if self._title_index is None:
+                # Reloaded while the index was being built
+                self._title_index = TitleIndex(self.data['books'])
+            books = self.data['books']
+            accept = (lambda title: books[title]['available_copies'] > 0) if available_only else None
+            return self._title_index.search(query, limit, fuzzy, accept)
+    
+    def _build_title_index(self, fuzzy: bool):
+        """Build the title index (and its trigrams, for fuzzy search) without holding the lock.
+        
+        Indexing a large catalog takes seconds, so it works from a copy of
+        the titles and swaps the result in; titles added meanwhile are
+        indexed on the way in.
+        """
+        with self.lock:
+            index, books = self._title_index, self.data['books']
+            if index is None:
+                titles = list(books)
+            elif fuzzy and not index.has_trigrams:
+                count = len(index.titles)
+            else:
+                return
+        
+        if index is None:
+            index = TitleIndex(titles, fuzzy)
+            with self.lock:
+                if self._title_index is None and self.data['books'] is books:
+                    for title in islice(books, len(titles), None):
+                        index.add(title)
+                    self._title_index = index
+        else:
+            grams = index.build_trigrams(count)
+            with self.lock:
+                if self._title_index is index and not index.has_trigrams:
+                    index.set_trigrams(*grams)
+    
+    def query_books(self, name_filter: str = '', available_only: bool = False, sort_by: str = 'title',
+                    descending: bool = False, offset: int = 0, limit: int = 50) -> Tuple[pd.DataFrame, int]:
+        """Get one page of the catalog and the number of books matching the filters"""
+        with self.lock:
+            if self._catalog_columns is None:
+                self._catalog_columns = CatalogColumns(self.data['books'])
+            catalog = self._catalog_columns
+            
+            if sort_by == 'title':
+                order = catalog.title_order
+            elif sort_by in ('total_copies', 'available_copies'):
+                order = np.argsort(getattr(catalog, sort_by), kind='stable')
+            else:
+                raise ValueError(f"Cannot sort books by '{sort_by}'.")
+            if descending:
+                order = order[::-1]
+            
+            mask = np.ones(len(catalog.titles), dtype=bool)
+            if available_only:
+                mask &= catalog.available_copies > 0
+            if name_filter:
+                mask &= catalog.matching(name_filter)
+            selected = order[mask[order]]
+            page = selected[offset:offset + limit]
+            
+            total_copies = catalog.total_copies[page]
+            available_copies = catalog.available_copies[page]
+            rows = pd.DataFrame({
+                'title': catalog.titles[page],
+                'total_copies': total_copies,
+                'available_copies': available_copies,
+                'issued': total_copies - available_copies
+            })
+        return rows, len(selected)
+    
+    def query_loans(self, user_filter: str = '', overdue_only: bool = False, sort_by: str = 'due_date',
+                    descending: bool = False, offset: int = 0, limit: int = 50) -> Tuple[pd.DataFrame, int]:
+        """Get one page of issued books and the number of loans matching the filters"""
+        loans = self.get_loans_frame()
+        if user_filter:
+            loans = loans[loans['user'].str.contains(user_filter, case=False, regex=False)]
+        if overdue_only:
+            loans = loans[loans['is_overdue']]
+        if sort_by not in loans.columns:
+            raise ValueError(f"Cannot sort loans by '{sort_by}'.")
+        loans = loans.sort_values(sort_by, ascending=not descending, kind='stable')
+        return loans.iloc[offset:offset + limit].reset_index(drop=True), len(loans)
+    
+    def get_overdue_books(self) -> List[Dict]:
+        """Get issued books that are past their due date"""
+        return self._issued_list(self.find_loans(due_before=self._overdue_cutoff()))
+    
+    def find_loans(self, user: str = None, book: str = None, due_before: str = None) -> Dict[str, Dict]:
+        """Find open loans matching all given filters, using storage or in-memory indexes"""
+        with self.lock:
+            if hasattr(self.storage, 'find_loans'):
+                return self.storage.find_loans(user, book, due_before)
+            
+            # Start from the narrowest index and filter the rest
+            index = self.loan_index
+            if user is not None:
+                candidates = index.by_user.get(user, ())
+            elif book is not None:
+                candidates = index.by_book.get(book, ())
+            elif due_before is not None:
+                candidates = index.due_before(due_before)
+            else:
+                candidates = self.data['issued_books']
+            
+            loans = {}
+            for trans_id in candidates:
+                details = self.data['issued_books'][trans_id]
+                if ((book is None or details['book'] == book) and
+                        (due_before is None or details['due_date'] < due_before)):
+                    loans[trans_id] = details
+            return loans
+    
+    def get_book_borrowers(self, book_name: str) -> List[Dict]:
+        """Get the open loans of a specific book"""
+        return self._issued_list(self.find_loans(book=book_name))
+    
+    def _issued_list(self, loans: Dict[str, Dict]) -> List[Dict]:
         issued_list = []
-        for trans_id, details in self.data['issued_books'].items():
+        for trans_id, details in loans.items():
             issued_list.append({
                 'transaction_id': trans_id,
                 'user': details['user'],
@@ -62,60 +536,161 @@ class Library:
             })
         return issued_list
     
-    def issue_book(self, user: str, book_name: str) -> Tuple[bool, str]:
-        """Issue a book to a user"""
-        if book_name not in self.data['books']:
-            return False, f"Book '{book_name}' not found in library."
-        
-        if self.data['books'][book_name]['available_copies'] <= 0:
-            return False, f"No copies of '{book_name}' available."
-        
-        # Create transaction
-        issue_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        due_date = (datetime.now() + timedelta(days=self.max_borrow_days)).strftime('%Y-%m-%d')
-        trans_id = f"{user}_{book_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        
-        # Update data
-        self.data['books'][book_name]['available_copies'] -= 1
-        self.data['issued_books'][trans_id] = {
-            'user': user,
-            'book': book_name,
-            'issue_date': issue_date,
-            'due_date': due_date
+    def get_circulation_summary(self) -> Dict:
+        """All-time loan totals from the history rollups, plus current copy utilization"""
+        self.history.catch_up()
+        rollups = self.history.rollups
+        stats = self.get_stats()
+        return {
+            'loans': rollups.issued,
+            'completed': rollups.returned,
+            'mean_loan_days': self.history.mean_loan_days(),
+            'utilization': 1 - stats['available_copies'] / stats['total_copies'] if stats['total_copies'] else 0.0
         }
-        
-        self.save_data()
-        return True, f"Book '{book_name}' issued successfully. Return by {due_date}"
     
-    def return_book(self, transaction_id: str) -> Tuple[bool, str]:
+    def get_popular_books(self, limit: int = 10) -> pd.DataFrame:
+        """Most borrowed titles with borrow counts, mean loan length and copies now on loan"""
+        self.history.catch_up()
+        rows = []
+        with self.lock:
+            for book, borrows in self.history.top_books(limit):
+                info = self.data['books'].get(book)
+                rows.append({
+                    'book': book,
+                    'borrows': borrows,
+                    'mean_loan_days': self.history.mean_loan_days(book),
+                    'utilization': (1 - info['available_copies'] / info['total_copies']
+                                    if info and info['total_copies'] else 0.0)
+                })
+        return pd.DataFrame(rows, columns=['book', 'borrows', 'mean_loan_days', 'utilization'])
+    
+    def get_daily_circulation(self, days: int = 30) -> pd.DataFrame:
+        """Issues and returns per day over the last `days` days"""
+        self.history.catch_up()
+        return pd.DataFrame(self.history.daily_counts(days), columns=['date', 'issues', 'returns'])
+    
+    def get_loan_history(self, limit: int = 50) -> List[Dict]:
+        """The most recently completed loans, newest first"""
+        self.history.catch_up()
+        return self.history.recent_returns(limit)
+    
+    @timed('issue_book')
+    def issue_book(self, user: str, book_name: str, wait: bool = False) -> Tuple[bool, str]:
+        """Issue a book to a user"""
+        return self.issue_many([(user, book_name)], wait)[0]
+    
+    @timed('return_book')
+    def return_book(self, transaction_id: str, wait: bool = False) -> Tuple[bool, str]:
         """Return a book using transaction ID"""
-        if transaction_id not in self.data['issued_books']:
-            return False, "Transaction ID not found."
-        
-        details = self.data['issued_books'][transaction_id]
-        book_name = details['book']
-        
-        # Update data
-        self.data['books'][book_name]['available_copies'] += 1
-        del self.data['issued_books'][transaction_id]
+        return self.return_many([transaction_id], wait)[0]
+    
+    def issue_many(self, requests: List[Tuple[str, str]], wait: bool = False) -> List[Tuple[bool, str]]:
+        """Issue several (user, book) pairs in one transaction with a single commit.
         
-        self.save_data()
-        return True, f"Book '{book_name}' returned successfully."
+        In write-behind mode the loans are queued for the writer thread
+        unless wait is set, which returns only once they are on disk.
+        """
+        results, records = [], []
+        with self.transaction():
+            for user, book_name in requests:
+                if book_name not in self.data['books']:
+                    results.append((False, f"Book '{book_name}' not found in library."))
+                    continue
+                
+                if self.data['books'][book_name]['available_copies'] <= 0:
+                    results.append((False, f"No copies of '{book_name}' available."))
+                    continue
+                
+                # Create transaction
+                issue_date = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                due_date = (datetime.now() + timedelta(days=self.max_borrow_days)).strftime('%Y-%m-%d')
+                trans_id = self._next_transaction_id()
+                
+                # Applied right away so later requests in the batch see it
+                record = {
+                    'op': 'issue',
+                    'id': trans_id,
+                    'user': user,
+                    'book': book_name,
+                    'issue_date': issue_date,
+                    'due_date': due_date
+                }
+                self._apply(record)
+                records.append(record)
+                results.append((True, f"Book '{book_name}' issued successfully. Return by {due_date}"))
+            
+            if records:
+                self.storage.commit(self.data, records)
+                self.history.record([{'op': 'issue', 'id': record['id'], 'user': record['user'],
+                                      'book': record['book'], 'date': record['issue_date']}
+                                     for record in records])
+        if wait and records:
+            self.flush()
+        return results
+    
+    def _next_transaction_id(self) -> str:
+        """Next loan ID in sequence; call inside a transaction so no other session can take it"""
+        return str(self.data.get('loan_seq', 0) + 1)
+    
+    def return_many(self, transaction_ids: List[str], wait: bool = False) -> List[Tuple[bool, str]]:
+        """Return several books by transaction ID in one transaction with a single commit; see issue_many for wait"""
+        results, records, completed = [], [], []
+        with self.transaction():
+            for transaction_id in transaction_ids:
+                if transaction_id not in self.data['issued_books']:
+                    results.append((False, "Transaction ID not found."))
+                    continue
+                
+                details = self.data['issued_books'][transaction_id]
+                book_name = details['book']
+                completed.append(self._completed_loan(transaction_id, details))
+                
+                record = {'op': 'return', 'id': transaction_id}
+                self._apply(record)
+                records.append(record)
+                results.append((True, f"Book '{book_name}' returned successfully."))
+            
+            if records:
+                self.storage.commit(self.data, records)
+                self.history.record(completed)
+        if wait and records:
+            self.flush()
+        return results
+    
+    def _completed_loan(self, trans_id: str, details: Dict) -> Dict:
+        """History entry for a loan being returned now"""
+        returned_at = datetime.now()
+        issued_at = datetime.strptime(details['issue_date'], '%Y-%m-%d %H:%M:%S')
+        return {
+            'op': 'return',
+            'id': trans_id,
+            'user': details['user'],
+            'book': details['book'],
+            'issue_date': details['issue_date'],
+            'due_date': details['due_date'],
+            'date': returned_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'days': round((returned_at - issued_at).total_seconds() / 86400, 4)
+        }
     
+    @timed('get_user_borrowed_books')
     def get_user_borrowed_books(self, user: str) -> List[Dict]:
-        """Get all books borrowed by a specific user"""
+        """Get all books borrowed by a specific user, from the cache unless their loans changed"""
+        with self.lock:
+            day = datetime.now().strftime('%Y-%m-%d')
+            return list(self.user_cache.get(user, 'borrowed', day, lambda: self._user_borrowed_books(user)))
+    
+    def _user_borrowed_books(self, user: str) -> List[Dict]:
         user_books = []
-        for trans_id, details in self.data['issued_books'].items():
-            if details['user'] == user:
-                days_remaining = self.calculate_days_remaining(details['due_date'])
-                user_books.append({
-                    'transaction_id': trans_id,
-                    'book': details['book'],
-                    'issue_date': details['issue_date'],
-                    'due_date': details['due_date'],
-                    'days_remaining': days_remaining,
-                    'is_overdue': days_remaining < 0
-                })
+        for trans_id, details in self.find_loans(user=user).items():
+            days_remaining = self.calculate_days_remaining(details['due_date'])
+            user_books.append({
+                'transaction_id': trans_id,
+                'book': details['book'],
+                'issue_date': details['issue_date'],
+                'due_date': details['due_date'],
+                'days_remaining': days_remaining,
+                'is_overdue': days_remaining < 0
+            })
         return user_books
     
     def calculate_days_remaining(self, due_date_str: str) -> int:
@@ -124,17 +699,51 @@ class Library:
         days_remaining = (due_date - datetime.now()).days
         return days_remaining
     
-    def add_new_book(self, book_name: str, copies: int) -> Tuple[bool, str]:
+    def add_new_book(self, book_name: str, copies: int, wait: bool = False) -> Tuple[bool, str]:
         """Add a new book to the library"""
-        if book_name in self.data['books']:
-            return False, f"Book '{book_name}' already exists."
-        
-        self.data['books'][book_name] = {
-            'total_copies': copies,
-            'available_copies': copies
-        }
-        self.save_data()
+        with self.transaction():
+            if book_name in self.data['books']:
+                return False, f"Book '{book_name}' already exists."
+            
+            self.commit([{'op': 'add', 'book': book_name, 'copies': copies}])
+        if wait:
+            self.flush()
         return True, f"Book '{book_name}' added with {copies} copies."
+    
+    def import_catalog(self, source: Union[str, IO], fmt: Optional[str] = None, chunk_size: int = 1000,
+                       progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """Stream books from a CSV or JSON Lines catalog, committing once per chunk.
+        
+        Titles already in the library get the imported copies added to their
+        counts. Memory use is bounded by chunk_size, whatever the file size.
+        progress is called with the running totals after every chunk.
+        """
+        summary = {'rows': 0, 'added': 0, 'restocked': 0, 'copies': 0, 'skipped': 0}
+        for chunk in read_chunks(read_catalog(source, fmt), chunk_size):
+            summary['rows'] += len(chunk)
+            
+            # Merge repeated titles within the chunk before touching the library
+            copies_by_title = {}
+            for entry in chunk:
+                if entry is None:
+                    summary['skipped'] += 1
+                    continue
+                title, copies = entry
+                copies_by_title[title] = copies_by_title.get(title, 0) + copies
+            
+            with self.transaction():
+                records = []
+                for title, copies in copies_by_title.items():
+                    op = 'restock' if title in self.data['books'] else 'add'
+                    records.append({'op': op, 'book': title, 'copies': copies})
+                    summary['restocked' if op == 'restock' else 'added'] += 1
+                    summary['copies'] += copies
+                if records:
+                    self.commit(records)
+            
+            if progress is not None:
+                progress(dict(summary))
+        return summary
 
 
 class User:
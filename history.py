@@ -0,0 +1,190 @@
+import heapq
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from storage import FileLock, write_atomic
+
+
+class CirculationRollups:
+    """Totals kept up to date one event at a time, so queries never scan the history"""
+
+    def __init__(self, state: Dict = None):
+        state = state or {}
+        self.borrow_counts: Dict[str, int] = state.get('borrow_counts', {})
+        self.loan_days: Dict[str, List[float]] = state.get('loan_days', {})  # book -> [total days, loans]
+        self.daily_issues: Dict[str, int] = state.get('daily_issues', {})
+        self.daily_returns: Dict[str, int] = state.get('daily_returns', {})
+        self.issued = state.get('issued', 0)
+        self.returned = state.get('returned', 0)
+        self.total_days = state.get('total_days', 0.0)
+
+    def apply(self, event: Dict):
+        book = event['book']
+        day = event['date'][:10]
+        if event['op'] == 'issue':
+            self.issued += 1
+            self.borrow_counts[book] = self.borrow_counts.get(book, 0) + 1
+            self.daily_issues[day] = self.daily_issues.get(day, 0) + 1
+        else:
+            self.returned += 1
+            self.total_days += event['days']
+            totals = self.loan_days.setdefault(book, [0.0, 0])
+            totals[0] += event['days']
+            totals[1] += 1
+            self.daily_returns[day] = self.daily_returns.get(day, 0) + 1
+
+    def to_dict(self) -> Dict:
+        return {
+            'borrow_counts': self.borrow_counts,
+            'loan_days': self.loan_days,
+            'daily_issues': self.daily_issues,
+            'daily_returns': self.daily_returns,
+            'issued': self.issued,
+            'returned': self.returned,
+            'total_days': self.total_days,
+        }
+
+
+class CirculationHistory:
+    """Append-only log of issues and returns with rollups maintained on write.
+
+    Every committed issue and return is appended as one JSON line to
+    ``path``; return lines are the completed loans. Each line is folded
+    into the rollups as soon as it is written, and lines written by other
+    processes are picked up by ``catch_up``. The rollups are checkpointed
+    to ``<path>.rollups`` with the log offset they cover, so startup only
+    replays the lines written since. Processes take turns writing the
+    checkpoint through ``<path>.lock``.
+    """
+
+    def __init__(self, path: str, checkpoint_every: int = 10000):
+        self.path = path
+        self.rollup_path = f"{path}.rollups"
+        self.checkpoint_every = checkpoint_every
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(f"{path}.lock")
+        self.rollups = CirculationRollups()
+        self.offset = 0
+        self._since_checkpoint = 0
+        self._file = None
+        self._load_checkpoint()
+        self.catch_up()
+
+    def record(self, events: List[Dict]):
+        """Append events; call with the storage lock held so appends from processes don't interleave"""
+        if not events:
+            return
+        with self.lock:
+            # Other processes only append under the same lock, so after this
+            # the log ends exactly where our rollups do
+            self.catch_up()
+            payload = ''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in events).encode('utf-8')
+            if self._file is None:
+                self._file = open(self.path, 'ab')
+            self._file.write(payload)
+            self._file.flush()
+            for event in events:
+                self.rollups.apply(event)
+            self.offset += len(payload)
+            self._since_checkpoint += len(events)
+            if self._since_checkpoint >= self.checkpoint_every:
+                self.checkpoint()
+
+    def catch_up(self):
+        """Fold in events appended since the last call, by this or any other process"""
+        with self.lock:
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if size < self.offset:
+                # The log was removed or replaced; start over
+                self.rollups = CirculationRollups()
+                self.offset = 0
+            if size == self.offset:
+                return
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # Still being written
+                    self.rollups.apply(json.loads(line))
+                    self.offset += len(line)
+                    self._since_checkpoint += 1
+            if self._since_checkpoint >= self.checkpoint_every:
+                self.checkpoint()
+
+    def checkpoint(self):
+        """Save the rollups so the next start doesn't replay the whole log"""
+        with self.lock, self.file_lock:
+            write_atomic(self.rollup_path, json.dumps({'offset': self.offset, 'rollups': self.rollups.to_dict()}),
+                         fsync=False, kind='history')
+            self._since_checkpoint = 0
+
+    def top_books(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """Most borrowed titles with their borrow counts"""
+        with self.lock:
+            return heapq.nlargest(limit, self.rollups.borrow_counts.items(), key=lambda item: (item[1], item[0]))
+
+    def mean_loan_days(self, book: str = None) -> float:
+        """Average length of completed loans, of one title or overall"""
+        with self.lock:
+            if book is None:
+                total, loans = self.rollups.total_days, self.rollups.returned
+            else:
+                total, loans = self.rollups.loan_days.get(book, (0.0, 0))
+            return total / loans if loans else 0.0
+
+    def daily_counts(self, days: int = 30) -> List[Tuple[str, int, int]]:
+        """(date, issues, returns) for each of the last `days` days, oldest first"""
+        today = datetime.now().date()
+        with self.lock:
+            rows = []
+            for offset in range(days - 1, -1, -1):
+                day = (today - timedelta(days=offset)).isoformat()
+                rows.append((day, self.rollups.daily_issues.get(day, 0), self.rollups.daily_returns.get(day, 0)))
+            return rows
+
+    def recent_returns(self, limit: int = 50, block_size: int = 1 << 16) -> List[Dict]:
+        """The last completed loans, newest first, read backwards from the end of the log"""
+        with self.lock:
+            if not os.path.exists(self.path):
+                return []
+            loans = []
+            with open(self.path, 'rb') as f:
+                position = self.offset
+                tail = b''
+                while position > 0 and len(loans) < limit:
+                    start = max(0, position - block_size)
+                    f.seek(start)
+                    lines = (f.read(position - start) + tail).split(b'\n')
+                    # The first piece may be a partial line unless we reached the start
+                    tail = lines.pop(0) if start > 0 else b''
+                    for line in reversed(lines):
+                        if line:
+                            event = json.loads(line)
+                            if event['op'] == 'return':
+                                loans.append(event)
+                                if len(loans) == limit:
+                                    break
+                    position = start
+            return loans
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self._since_checkpoint:
+                self.checkpoint()
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.rollup_path):
+            return
+        try:
+            with open(self.rollup_path, 'r') as f:
+                state = json.load(f)
+        except ValueError:
+            return  # Unreadable; replay the log instead
+        self.rollups = CirculationRollups(state['rollups'])
+        self.offset = state['offset']
@@ -0,0 +1,192 @@
+"""Lightweight timing and counters for the library, in Prometheus text format.
+
+Collection is off unless LMS_METRICS=1 is set or ``REGISTRY.enabled`` is
+switched on at runtime; while off, an instrumented call costs one
+attribute check.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = tuple(1 << shift for shift in range(10, 31, 2))  # 1 KiB to 1 GiB
+
+
+class Histogram:
+    """Bucketed observations per label value, with sum, count and maximum"""
+
+    def __init__(self, name: str, description: str, buckets: Tuple[float, ...], label: str):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.label = label
+        self.series: Dict[str, List] = {}  # label value -> [bucket counts, sum, count, max]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, label_value: str = ''):
+        with self._lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0, value]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+            series[3] = max(series[3], value)
+
+    def quantile(self, label_value: str, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (the maximum for the last bucket)"""
+        with self._lock:
+            series = self.series.get(label_value)
+            if series is None:
+                return None
+            return self._quantile(series, q)
+
+    def summary(self) -> List[Dict]:
+        """One row per label value: count, mean, p50, p95 and max"""
+        with self._lock:
+            rows = []
+            for label_value, series in sorted(self.series.items()):
+                _, total, count, largest = series
+                rows.append({
+                    self.label: label_value,
+                    'count': count,
+                    'mean': total / count,
+                    'p50': self._quantile(series, 0.5),
+                    'p95': self._quantile(series, 0.95),
+                    'max': largest,
+                })
+            return rows
+
+    def _quantile(self, series: List, q: float) -> float:
+        counts, _, count, largest = series
+        rank, seen = q * count, 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            seen += bucket_count
+            if seen >= rank:
+                return min(bound, largest)
+        return largest
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, (counts, total, count, _) in sorted(self.series.items()):
+                label = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound:g}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label}}} {total:g}')
+                lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+
+class Counter:
+    """Monotonic counts per label value"""
+
+    def __init__(self, name: str, description: str, label: str):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.values: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, label_value: str = '', amount: int = 1):
+        with self._lock:
+            self.values[label_value] = self.values.get(label_value, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_value, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {value}')
+        return lines
+
+
+class Registry:
+    """All metrics of the process and the switch that turns collection on"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.operation_seconds = Histogram(
+            'lms_operation_seconds', 'Time spent in Library operations.', LATENCY_BUCKETS, 'operation')
+        self.page_render_seconds = Histogram(
+            'lms_page_render_seconds', 'Time to render one page of the web UI.', LATENCY_BUCKETS, 'page')
+        self.write_bytes = Histogram(
+            'lms_write_bytes', 'Bytes written per storage write.', BYTES_BUCKETS, 'kind')
+        self.reruns = Counter('lms_reruns_total', 'Streamlit script runs.', 'page')
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in (self.operation_seconds, self.page_render_seconds, self.write_bytes, self.reruns):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Drop everything collected so far"""
+        self.__init__(self.enabled)
+
+
+REGISTRY = Registry(enabled=os.environ.get('LMS_METRICS') == '1')
+
+
+def timed(operation: str) -> Callable:
+    """Decorator recording the duration of each call under operation"""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not REGISTRY.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                REGISTRY.operation_seconds.observe(time.perf_counter() - start, operation)
+        return wrapper
+    return decorate
+
+
+def count_rerun(page: str):
+    """Count one run of the web UI script"""
+    if REGISTRY.enabled:
+        REGISTRY.reruns.increment(page)
+
+
+def record_page_render(page: str, seconds: float):
+    """Record how long a page took to render"""
+    if REGISTRY.enabled:
+        REGISTRY.page_render_seconds.observe(seconds, page)
+
+
+def record_write(kind: str, size: int):
+    """Count bytes written by a storage backend"""
+    if REGISTRY.enabled:
+        REGISTRY.write_bytes.observe(size, kind)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Expose /metrics over HTTP on a daemon thread; local connections only unless host says otherwise"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
@@ -0,0 +1,51 @@
+"""Copy library data from one storage backend to another.
+
+Usage:
+    python migrate.py library_data.json library_data.db --to sqlite
+    python migrate.py library_data.bin library_data.json --from binary --to json
+"""
+import argparse
+import sys
+
+from storage import STORAGE_BACKENDS, open_storage
+
+
+def migrate(source: str, target: str, source_kind: str = 'json', target_kind: str = 'sqlite',
+            force: bool = False) -> int:
+    """Import all books and loans from source into target; returns the number of loans copied"""
+    reader = open_storage(source_kind, source)
+    with reader.lock:
+        data = reader.load()
+    reader.close()
+    if data is None:
+        raise ValueError(f"No library data found in '{source}'.")
+
+    writer = open_storage(target_kind, target)
+    with writer.lock:
+        if writer.load() is not None and not force:
+            writer.close()
+            raise ValueError(f"'{target}' already contains library data. Use --force to overwrite it.")
+        writer.save(data)
+    writer.close()
+    return len(data['issued_books'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='Data file to read')
+    parser.add_argument('target', help='Data file to write')
+    parser.add_argument('--from', dest='source_kind', default='json', choices=list(STORAGE_BACKENDS))
+    parser.add_argument('--to', dest='target_kind', default='sqlite', choices=list(STORAGE_BACKENDS))
+    parser.add_argument('--force', action='store_true', help='Overwrite existing data in the target')
+    args = parser.parse_args()
+
+    try:
+        loans = migrate(args.source, args.target, args.source_kind, args.target_kind, args.force)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    print(f"Migrated '{args.source}' ({args.source_kind}) to '{args.target}' ({args.target_kind}), {loans} open loans.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+
+class OverdueReport:
+    """Overdue loans as of one scan, oldest due date first"""
+
+    def __init__(self, scanned_at: datetime, loans: Dict[str, Dict]):
+        self.scanned_at = scanned_at
+        self.loans = loans
+
+    @property
+    def count(self) -> int:
+        return len(self.loans)
+
+    def due_since(self, date: str) -> Dict[str, Dict]:
+        """Loans that became overdue on or after date (YYYY-MM-DD)"""
+        return {trans_id: details for trans_id, details in self.loans.items() if details['due_date'] >= date}
+
+    def newly_overdue(self, days: int = 1) -> Dict[str, Dict]:
+        """Loans that became overdue within the last `days` days, today included"""
+        return self.due_since((self.scanned_at - timedelta(days=days)).strftime('%Y-%m-%d'))
+
+
+class OverdueScanner:
+    """Keeps open loans in a min-heap on due date and publishes the overdue ones.
+
+    The library notifies the scanner of every issue and return, so a scan
+    only pops the loans whose due date has passed since the last one:
+    O(log n) per newly overdue loan instead of a pass over every loan.
+    Returned loans are dropped from the heap lazily when they reach the top.
+    Readers use ``report``, an immutable snapshot that is replaced whenever
+    the overdue set changes.
+    """
+
+    def __init__(self, library, interval: float = 60.0):
+        self.library = library
+        self.interval = interval
+        self._report = OverdueReport(datetime.now(), {})
+        self._changed = False
+        self._heap: List[Tuple[str, str]] = []  # (due_date, transaction_id)
+        self._overdue: Dict[str, Dict] = {}
+        self._stale = True  # Heap must be rebuilt from the library's loans
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        library.add_listener(self)
+
+    # Library listener interface; called with the library lock held
+    def loan_issued(self, trans_id: str, details: Dict):
+        with self._lock:
+            if not self._stale:
+                heapq.heappush(self._heap, (details['due_date'], trans_id))
+
+    def loan_returned(self, trans_id: str):
+        with self._lock:
+            if self._overdue.pop(trans_id, None) is not None:
+                self._changed = True
+
+    def reset(self):
+        with self._lock:
+            self._stale = True
+
+    def scan(self) -> OverdueReport:
+        """Move loans that have fallen due into the overdue set and publish it"""
+        library = self.library
+        library.refresh()
+        with library.lock, self._lock:
+            issued = library.data['issued_books']
+            if self._stale:
+                self._heap = [(details['due_date'], trans_id) for trans_id, details in issued.items()]
+                heapq.heapify(self._heap)
+                self._overdue = {}
+                self._stale = False
+                self._changed = True
+
+            # The library's own rule, so counts match get_stats and get_overdue_books
+            now = datetime.now()
+            cutoff = library._overdue_cutoff()
+            while self._heap and self._heap[0][0] < cutoff:
+                due_date, trans_id = heapq.heappop(self._heap)
+                details = issued.get(trans_id)
+                if details is not None and details['due_date'] == due_date:
+                    self._overdue[trans_id] = details
+                    self._changed = True
+            loans = dict(self._overdue) if self._changed else self._report.loans
+            self._report = OverdueReport(now, loans)
+            self._changed = False
+            return self._report
+
+    @property
+    def report(self) -> OverdueReport:
+        """Latest published overdue loans"""
+        with self._lock:
+            if self._changed:
+                # Returns since the last scan; republished once, on read
+                self._report = OverdueReport(self._report.scanned_at, dict(self._overdue))
+                self._changed = False
+            return self._report
+
+    def start(self):
+        """Scan every `interval` seconds on a daemon thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='overdue-scanner', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.scan()
+            self._stop.wait(self.interval)
@@ -0,0 +1,185 @@
+import heapq
+import math
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens of a title or query"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def trigrams(text: str) -> Set[str]:
+    """Character trigrams of text, padded so short words still produce some"""
+    padded = f"  {text.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Token and prefix index over book titles, with optional trigram fuzzy matching.
+
+    Every query token must prefix-match some word of a title. When that finds
+    fewer than the requested number of titles, titles sharing the most
+    character trigrams with the query fill the remaining places, so typos
+    still find something. The trigram index is built on the first fuzzy
+    search (or up front with ``fuzzy=True``) and kept up to date from then on.
+    """
+
+    min_similarity = 0.4
+    common_gram_share = 0.02  # Trigrams in more titles than this share are too common to look up...
+    common_gram_floor = 1000  # ...unless they are in fewer titles than this
+    max_postings = 50000  # Title ids scanned per fuzzy query at most
+
+    def __init__(self, titles: Iterable[str] = (), fuzzy: bool = False):
+        self.titles: List[str] = list(titles)
+        self.postings: Dict[str, Set[int]] = {}
+        for title_id, title in enumerate(self.titles):
+            for token in set(tokenize(title)):
+                postings = self.postings.get(token)
+                if postings is None:
+                    postings = self.postings[token] = set()
+                postings.add(title_id)
+        # Sorted once here; add() keeps it sorted from then on
+        self.vocabulary: List[str] = sorted(self.postings)  # Distinct tokens, for prefix ranges
+        self._trigram_postings: Optional[Dict[str, Set[int]]] = None
+        self._trigram_counts: List[int] = []
+        if fuzzy:
+            self.set_trigrams(*self.build_trigrams(len(self.titles)))
+
+    @property
+    def has_trigrams(self) -> bool:
+        return self._trigram_postings is not None
+
+    def build_trigrams(self, count: int) -> Tuple[Dict[str, Set[int]], List[int]]:
+        """Trigram postings and counts of the first count titles, without installing them.
+
+        Doesn't modify the index, so it can run while other threads search
+        it; pass the result to set_trigrams.
+        """
+        postings: Dict[str, Set[int]] = {}
+        counts = []
+        for title_id, title in enumerate(self.titles[:count]):
+            grams = trigrams(title)
+            counts.append(len(grams))
+            for gram in grams:
+                ids = postings.get(gram)
+                if ids is None:
+                    ids = postings[gram] = set()
+                ids.add(title_id)
+        return postings, counts
+
+    def set_trigrams(self, postings: Dict[str, Set[int]], counts: List[int]):
+        """Install trigrams from build_trigrams, indexing titles added since"""
+        self._trigram_postings = postings
+        self._trigram_counts = counts
+        for title_id in range(len(counts), len(self.titles)):
+            self._add_trigrams(title_id, self.titles[title_id])
+
+    def add(self, title: str):
+        """Index a newly added title"""
+        title_id = len(self.titles)
+        self.titles.append(title)
+        for token in set(tokenize(title)):
+            if token not in self.postings:
+                self.postings[token] = set()
+                insort(self.vocabulary, token)
+            self.postings[token].add(title_id)
+        if self._trigram_postings is not None:
+            self._add_trigrams(title_id, title)
+
+    def search(self, query: str, limit: int = 10, fuzzy: bool = True,
+               accept: Optional[Callable[[str], bool]] = None) -> List[str]:
+        """Best matching titles for query, at most limit of them"""
+        tokens = tokenize(query)
+        if not tokens or limit <= 0:
+            return []
+
+        candidates = None
+        for matches in sorted((self._prefix_matches(token) for token in tokens), key=len):
+            candidates = matches if candidates is None else candidates & matches
+            if not candidates:
+                break
+        candidates = [self.titles[i] for i in candidates]
+        if accept is not None:
+            candidates = [title for title in candidates if accept(title)]
+
+        # Titles starting with the query first, then shorter (closer) titles
+        lowered = query.lower()
+        results = heapq.nsmallest(limit, candidates,
+                                  key=lambda title: (not title.lower().startswith(lowered), len(title), title))
+        if fuzzy and len(results) < limit:
+            found = set(results)
+            for title in self._fuzzy(query, accept, limit + len(found)):
+                if title not in found:
+                    results.append(title)
+                    if len(results) == limit:
+                        break
+        return results
+
+    def _prefix_matches(self, prefix: str) -> Set[int]:
+        start = bisect_left(self.vocabulary, prefix)
+        end = bisect_left(self.vocabulary, prefix + '\uffff', start)
+        if end - start == 1:
+            return self.postings[self.vocabulary[start]]
+        return set().union(*(self.postings[token] for token in self.vocabulary[start:end]))
+
+    def _fuzzy(self, query: str, accept: Optional[Callable[[str], bool]], limit: Optional[int] = None) -> List[str]:
+        """The `limit` titles (all, if None) sharing the largest share of the query's trigrams.
+        
+        Only the rarer query trigrams are looked up: padded ones like "  t"
+        occur in most titles and would make every query scan the catalog.
+        A title can only reach min_similarity by sharing enough of the rare
+        trigrams, so candidates with fewer are never scored; candidates are
+        scored most shared first, until none left can make the top `limit`.
+        """
+        if self._trigram_postings is None:
+            self.set_trigrams(*self.build_trigrams(len(self.titles)))
+
+        query_trigrams = trigrams(query)
+        rarest_first = sorted(query_trigrams, key=lambda gram: len(self._trigram_postings.get(gram, ())))
+        common = max(self.common_gram_floor, int(len(self.titles) * self.common_gram_share))
+        shared = Counter()
+        skipped = []
+        scanned = 0
+        for position, gram in enumerate(rarest_first):
+            ids = self._trigram_postings.get(gram, ())
+            if position and (len(ids) > common or scanned + len(ids) > self.max_postings):
+                # Sorted rarest first, so every remaining gram is at least as common
+                skipped = [self._trigram_postings[rest] for rest in rarest_first[position:]]
+                break
+            shared.update(ids)
+            scanned += len(ids)
+
+        needed = max(1, math.ceil(self.min_similarity * len(query_trigrams)) - len(skipped))
+        scored = []
+        top = []  # Min-heap of the best `limit` similarities so far
+        for title_id, count in shared.most_common():
+            if count < needed:
+                break
+            if limit is not None and len(top) == limit and (count + len(skipped)) / len(query_trigrams) < top[0]:
+                break  # Even sharing every skipped trigram wouldn't make the top
+            # The skipped trigrams count too; look them up for this title only
+            count += sum(1 for ids in skipped if title_id in ids)
+            similarity = count / len(query_trigrams)
+            title = self.titles[title_id]
+            if similarity < self.min_similarity or (accept is not None and not accept(title)):
+                continue
+            # Among equally similar titles prefer those with fewer extra trigrams
+            scored.append((-similarity, self._trigram_counts[title_id], title))
+            if limit is not None:
+                if len(top) < limit:
+                    heapq.heappush(top, similarity)
+                elif similarity > top[0]:
+                    heapq.heapreplace(top, similarity)
+        scored.sort()
+        return [title for _, _, title in scored[:limit]]
+
+    def _add_trigrams(self, title_id: int, title: str):
+        grams = trigrams(title)
+        self._trigram_counts.append(len(grams))
+        for gram in grams:
+            self._trigram_postings.setdefault(gram, set()).add(title_id)
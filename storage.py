@@ -0,0 +1,1094 @@
+import atexit
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+from collections.abc import Mapping, MutableMapping
+from sys import intern
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from metrics import record_write
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class Record(Mapping):
+    """Fixed-field record that reads and writes like the dict it replaces.
+
+    Books and loans are stored as instances of small ``__slots__`` classes
+    instead of one dict each, which cuts their memory several-fold while
+    ``record['field']`` keeps working everywhere.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def to_dict(self) -> Dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class BookRecord(Record):
+    """Copy counts of one title"""
+    __slots__ = ('total_copies', 'available_copies')
+
+    def __init__(self, total_copies: int, available_copies: int):
+        self.total_copies = total_copies
+        self.available_copies = available_copies
+
+
+class LoanRecord(Record):
+    """One open loan; user, book and due date strings are interned and shared"""
+    __slots__ = ('user', 'book', 'issue_date', 'due_date')
+
+    def __init__(self, user: str, book: str, issue_date: str, due_date: str):
+        self.user = intern(user)
+        self.book = intern(book)
+        self.issue_date = issue_date
+        self.due_date = intern(due_date)
+
+
+_BOOK_FIELDS = BookRecord.__slots__
+_LOAN_FIELDS = LoanRecord.__slots__
+
+
+def decode_object(obj: Dict):
+    """json object_hook that swaps book and loan dicts for records as the file is parsed"""
+    size = len(obj)
+    if size == 4 and 'due_date' in obj:
+        return LoanRecord(obj['user'], obj['book'], obj['issue_date'], obj['due_date'])
+    if size == 2 and 'available_copies' in obj:
+        return BookRecord(obj['total_copies'], obj['available_copies'])
+    if obj and isinstance(next(iter(obj.values())), BookRecord):
+        # The catalog: intern titles so loans share the same string objects
+        return {intern(title): info for title, info in obj.items()}
+    return obj
+
+
+def compact_record(obj: Dict):
+    """Turn a book or loan dict (in any field order) into a record"""
+    if isinstance(obj, Record):
+        return obj
+    if obj.keys() == set(_BOOK_FIELDS):
+        return BookRecord(obj['total_copies'], obj['available_copies'])
+    if obj.keys() == set(_LOAN_FIELDS):
+        return LoanRecord(obj['user'], obj['book'], obj['issue_date'], obj['due_date'])
+    return obj
+
+
+def compact_data(data: Dict) -> Dict:
+    """Convert library data built from plain dicts to records in place"""
+    data['books'] = {intern(title): compact_record(info) for title, info in data['books'].items()}
+    data['issued_books'] = {trans_id: compact_record(details) for trans_id, details in data['issued_books'].items()}
+    return data
+
+
+def plain_data(data: Dict) -> Dict:
+    """Copy of library data with books and loans as plain dicts, ready for json.dumps.
+
+    Converting in two comprehensions up front is much cheaper than a
+    json ``default`` hook, which costs a Python call per record.
+    """
+    return dict(
+        data,
+        books={title: info.to_dict() if isinstance(info, Record) else dict(info)
+               for title, info in data['books'].items()},
+        issued_books={trans_id: details.to_dict() if isinstance(details, Record) else dict(details)
+                      for trans_id, details in data['issued_books'].items()})
+
+
+def read_json(f):
+    """Parse a library data file straight into records"""
+    return json.load(f, object_hook=decode_object)
+
+
+def apply_record(data: Dict, record: Dict):
+    """Apply a single mutation record to library data"""
+    op = record['op']
+    if op == 'issue':
+        data['books'][record['book']]['available_copies'] -= 1
+        data['issued_books'][record['id']] = LoanRecord(
+            record['user'], record['book'], record['issue_date'], record['due_date'])
+        if record['id'].isdigit():
+            # Older IDs are "<user>_<book>_<timestamp>" strings and never all digits
+            data['loan_seq'] = max(data.get('loan_seq', 0), int(record['id']))
+    elif op == 'return':
+        details = data['issued_books'].pop(record['id'], None)
+        if details is not None:
+            data['books'][details['book']]['available_copies'] += 1
+    elif op == 'add':
+        data['books'][intern(record['book'])] = BookRecord(record['copies'], record['copies'])
+    elif op == 'restock':
+        info = data['books'][record['book']]
+        info['total_copies'] += record['copies']
+        info['available_copies'] += record['copies']
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """Cheap fingerprint of a file's on-disk state, or None if it is missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def write_atomic(path: str, text: Union[str, bytes], fsync: bool = True, kind: str = 'snapshot'):
+    """Write a file through a temporary file and an atomic rename"""
+    # A temporary file of our own, so concurrent writers never share one
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=f"{os.path.basename(path)}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(text, bytes) else 'w') as f:
+            f.write(text)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+            record_write(kind, f.tell())
+        # mkstemp creates the file private to us; keep the mode files had before
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class FileLock:
+    """Exclusive lock shared by threads of this process and by other processes.
+
+    Re-entrant for the thread that holds it. Other threads wait on an
+    in-process lock, other processes on an OS lock of ``path``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                if self._fd is None:
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                self._lock_fd()
+            except:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._unlock_fd()
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _lock_fd(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            return
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after ~10 seconds; keep waiting
+                continue
+
+    def _unlock_fd(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+
+
+class JSONStorage:
+    """Stores the whole library as one JSON document, rewritten on every commit.
+
+    Writes go to a temporary file that is renamed over the data file, so
+    other processes only ever see complete commits.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = FileLock(f"{path}.lock")
+        self._known = None
+
+    def load(self) -> Optional[Dict]:
+        """Load library data, or None if the file is missing or unreadable"""
+        self._known = file_signature(self.path)
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r') as f:
+                    return read_json(f)
+            except:
+                return None
+        return None
+
+    def save(self, data: Dict):
+        """Write a full copy of library data"""
+        self._write(plain_data(data))
+
+    def commit(self, data: Dict, records: List[Dict]):
+        """Persist mutations by rewriting the whole document"""
+        self.prepare_commit(data, records)()
+
+    def prepare_commit(self, data: Dict, records: List[Dict]) -> Callable[[], None]:
+        """Copy data now; the returned write serializes the copy and no longer reads data"""
+        snapshot = plain_data(data)
+        return lambda: self._write(snapshot)
+
+    def changed(self) -> bool:
+        """True if the file was modified by someone other than this instance"""
+        return file_signature(self.path) != self._known
+
+    def poll(self) -> Optional[List[Dict]]:
+        """Records committed elsewhere since the last sync, or None to reload"""
+        return None if self.changed() else []
+
+    def close(self):
+        pass
+
+    def _write(self, snapshot: Dict):
+        write_atomic(self.path, json.dumps(snapshot, indent=4), kind='json')
+        self._known = file_signature(self.path)
+
+
+class JournalStorage:
+    """Snapshot plus append-only journal of mutation records.
+
+    Every commit appends one compact JSON line per record to
+    ``<path>.journal``, so the cost of a transaction does not depend on the
+    size of the library. Once the journal grows larger than the snapshot it
+    is folded into a fresh snapshot on a background thread. Records carry a
+    sequence number and the snapshot remembers the last one it contains, so
+    replaying a journal that was already compacted is harmless.
+
+    Snapshot writes and journal rotations happen under ``lock``; callers
+    hold it around ``load``, ``poll`` and ``commit``.
+    """
+
+    def __init__(self, path: str, min_compact_bytes: int = 1 << 20, fsync: bool = True):
+        self.path = path
+        self.journal_path = f"{path}.journal"
+        self.old_journal_path = f"{path}.journal.old"
+        self.min_compact_bytes = min_compact_bytes
+        self.fsync = fsync
+        self.lock = FileLock(f"{path}.lock")
+        self.seq = 0
+        self.snapshot_bytes = 0
+        self.journal_bytes = 0
+        self._journal = None
+        self._has_snapshot = False
+        self._known_snapshot = None
+        self._known_journal = None
+        self._compactor = None
+
+    def load(self) -> Optional[Dict]:
+        """Load the snapshot and replay any journaled records on top of it"""
+        self._close_journal()
+        self._known_snapshot = file_signature(self.path)
+        data = None
+        if os.path.exists(self.path):
+            try:
+                data = self._read_snapshot()
+                self.snapshot_bytes = os.path.getsize(self.path)
+            except:
+                data = None
+        if data is None:
+            return None
+
+        self._has_snapshot = True
+        self.seq = data.pop('journal_seq', 0)
+        had_old = os.path.exists(self.old_journal_path)
+        for journal_path in (self.old_journal_path, self.journal_path):
+            for record in self._read_journal(journal_path):
+                if record['seq'] > self.seq:
+                    apply_record(data, record)
+                    self.seq = record['seq']
+
+        self.journal_bytes = self._size(self.journal_path)
+        self._known_journal = file_signature(self.journal_path)
+        if had_old:
+            # A compaction crashed or is still queued; fold everything now
+            self._fold(data)
+        return data
+
+    def save(self, data: Dict):
+        """Write a full snapshot and start an empty journal"""
+        with self.lock:
+            self._fold(data)
+
+    def commit(self, data: Dict, records: List[Dict]):
+        """Append records to the journal, compacting in the background when due"""
+        with self.lock:
+            self.prepare_commit(data, records)()
+
+    def prepare_commit(self, data: Dict, records: List[Dict]) -> Callable[[], None]:
+        """Encode records, and a snapshot if one is due, now; the returned write no longer reads data.
+
+        Call with ``lock`` held until the write has run.
+        """
+        if not self._has_snapshot:
+            # Nothing to replay the journal onto yet
+            self.seq += len(records)
+            snapshot = self._snapshot(data)
+            return lambda: self._replace_snapshot(self._encode(snapshot))
+
+        lines = []
+        for record in records:
+            self.seq += 1
+            lines.append(json.dumps(dict(record, seq=self.seq), separators=(',', ':')))
+        payload = '\n'.join(lines) + '\n'
+        size = len(payload.encode('utf-8'))
+        # The snapshot must be taken together with the records it covers
+        snapshot = self._snapshot(data) if self._compaction_due(size) else None
+        return lambda: self._append(payload, size, snapshot)
+
+    def _append(self, payload: str, size: int, snapshot):
+        journal = self._open_journal()
+        journal.write(payload)
+        journal.flush()
+        if self.fsync:
+            os.fsync(journal.fileno())
+        self.journal_bytes += size
+        record_write('journal', size)
+        self._known_journal = file_signature(self.journal_path)
+
+        if snapshot is not None:
+            self._start_compaction(snapshot)
+
+    def changed(self) -> bool:
+        """True if the snapshot or journal was modified by someone else"""
+        return (file_signature(self.path) != self._known_snapshot or
+                file_signature(self.journal_path) != self._known_journal)
+
+    def poll(self) -> Optional[List[Dict]]:
+        """Records appended by other processes since the last sync, or None to reload"""
+        if not self.changed():
+            return []
+        journal = file_signature(self.journal_path)
+        if (file_signature(self.path) != self._known_snapshot or journal is None or
+                self._known_journal is None or journal[0] != self._known_journal[0]):
+            # Snapshot rewritten or journal rotated
+            return None
+
+        records = []
+        with open(self.journal_path, 'rb') as f:
+            f.seek(self.journal_bytes)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                record = json.loads(line)
+                self.journal_bytes += len(line)
+                if record['seq'] > self.seq:
+                    records.append(record)
+                    self.seq = record['seq']
+        self._known_journal = journal
+        return records
+
+    def wait(self):
+        """Block until a running compaction has finished"""
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def close(self):
+        self.wait()
+        with self.lock:
+            self._close_journal()
+
+    def _compaction_due(self, appending: int = 0) -> bool:
+        """Whether the journal is too long once `appending` more bytes are written"""
+        if os.path.exists(self.old_journal_path):
+            # This or another process is already compacting
+            return False
+        return self.journal_bytes + appending > max(self.min_compact_bytes, self.snapshot_bytes)
+
+    def _start_compaction(self, snapshot):
+        # snapshot was taken with the records just journaled, so it is
+        # consistent with the journal; encoding it, the disk write and the
+        # fsync happen on the compactor thread.
+        self._close_journal()
+        os.replace(self.journal_path, self.old_journal_path)
+        self._known_journal = None
+        self.journal_bytes = 0
+        self._compactor = threading.Thread(
+            target=self._compact, args=(snapshot, self._known_snapshot), daemon=True)
+        self._compactor.start()
+
+    def _compact(self, snapshot, expected_snapshot):
+        text = self._encode(snapshot)
+        with self.lock:
+            if file_signature(self.path) == expected_snapshot:
+                self._write_snapshot(text)
+            # Otherwise a newer full snapshot was saved meanwhile
+            if os.path.exists(self.old_journal_path):
+                os.remove(self.old_journal_path)
+
+    def _fold(self, data: Dict):
+        """Write data as the snapshot and discard both journals"""
+        self._replace_snapshot(self._encode(self._snapshot(data)))
+
+    def _replace_snapshot(self, text: Union[str, bytes]):
+        self._write_snapshot(text)
+        self._close_journal()
+        open(self.journal_path, 'w').close()
+        if os.path.exists(self.old_journal_path):
+            os.remove(self.old_journal_path)
+        self._known_journal = file_signature(self.journal_path)
+        self.journal_bytes = 0
+        self._has_snapshot = True
+
+    def _read_snapshot(self) -> Dict:
+        with open(self.path, 'r') as f:
+            return read_json(f)
+
+    def _snapshot(self, data: Dict):
+        """Copy of data that no longer changes with it, for _encode"""
+        return dict(plain_data(data), journal_seq=self.seq)
+
+    def _encode(self, snapshot) -> Union[str, bytes]:
+        return json.dumps(snapshot, separators=(',', ':'))
+
+    def _write_snapshot(self, text: Union[str, bytes]):
+        write_atomic(self.path, text, self.fsync)
+        self._known_snapshot = file_signature(self.path)
+        self.snapshot_bytes = len(text)
+
+    def _open_journal(self):
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        return self._journal
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def _read_journal(self, journal_path: str) -> List[Dict]:
+        records = []
+        if not os.path.exists(journal_path):
+            return records
+        valid_bytes = 0
+        with open(journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError('incomplete record')
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Torn write from a crash; drop it so new appends start clean
+                    with open(journal_path, 'r+b') as journal:
+                        journal.truncate(valid_bytes)
+                    break
+                valid_bytes += len(line)
+        return records
+
+    @staticmethod
+    def _size(path: str) -> int:
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class SQLiteStorage:
+    """Stores books and loans as rows of a local SQLite database.
+
+    Commits touch only the rows a record changes. Loans are indexed on
+    user, book and due date, so ``find_loans`` answers per-user, per-book
+    and overdue queries without scanning every loan. Committed records are
+    also kept in a ``changes`` table that other processes replay in
+    ``poll``. A ``.json`` data file name is mapped to the matching ``.db``.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS books (
+            title TEXT PRIMARY KEY,
+            total_copies INTEGER NOT NULL,
+            available_copies INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS loans (
+            id TEXT PRIMARY KEY,
+            user TEXT NOT NULL,
+            book TEXT NOT NULL,
+            issue_date TEXT NOT NULL,
+            due_date TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS loans_by_user ON loans (user, due_date);
+        CREATE INDEX IF NOT EXISTS loans_by_book ON loans (book);
+        CREATE INDEX IF NOT EXISTS loans_by_due_date ON loans (due_date);
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            record TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    '''
+
+    def __init__(self, path: str, keep_changes: int = 10000):
+        if path.endswith('.json'):
+            path = path[:-len('.json')] + '.db'
+        self.path = path
+        self.keep_changes = keep_changes
+        self.lock = FileLock(f"{path}.lock")
+        self.seq = 0
+        self._known = None
+        self._has_rows = False
+        self._trimmed_at = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(self.SCHEMA)
+
+    def load(self) -> Optional[Dict]:
+        """Load all books and loans, or None if the database is empty"""
+        books = {intern(title): BookRecord(total, available)
+                 for title, total, available in self._db.execute(
+                     'SELECT title, total_copies, available_copies FROM books')}
+        issued = {trans_id: LoanRecord(user, book, issue_date, due_date)
+                  for trans_id, user, book, issue_date, due_date in self._db.execute(
+                      'SELECT id, user, book, issue_date, due_date FROM loans')}
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'loan_seq'").fetchone()
+        self.seq = self._last_seq()
+        self._known = self._data_version()
+        self._has_rows = bool(books or issued)
+        if not self._has_rows:
+            return None
+        return {'books': books, 'issued_books': issued, 'loan_seq': row[0] if row else 0}
+
+    def save(self, data: Dict):
+        """Replace the whole database contents with data"""
+        with self._db:
+            self._db.execute('DELETE FROM books')
+            self._db.execute('DELETE FROM loans')
+            self._db.executemany(
+                'INSERT INTO books (title, total_copies, available_copies) VALUES (?, ?, ?)',
+                ((title, info['total_copies'], info['available_copies'])
+                 for title, info in data['books'].items()))
+            self._db.executemany(
+                'INSERT INTO loans (id, user, book, issue_date, due_date) VALUES (?, ?, ?, ?, ?)',
+                ((trans_id, loan['user'], loan['book'], loan['issue_date'], loan['due_date'])
+                 for trans_id, loan in data['issued_books'].items()))
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('loan_seq', ?)",
+                             (data.get('loan_seq', 0),))
+            # Other processes can't replay across a full rewrite
+            self._db.execute('DELETE FROM changes')
+            self._db.execute('INSERT INTO changes (record) VALUES (?)', (json.dumps({'op': 'reload'}),))
+        self.seq = self._last_seq()
+        self._has_rows = True
+
+    def commit(self, data: Dict, records: List[Dict]):
+        """Apply records as row updates in a single SQLite transaction"""
+        self.prepare_commit(data, records)()
+
+    def prepare_commit(self, data: Dict, records: List[Dict]) -> Callable[[], None]:
+        """The returned write only reads records, not data"""
+        if not self._has_rows:
+            # The defaults only exist in memory so far; a one-off full write
+            self.save(data)
+            return lambda: None
+        return lambda: self._commit_records(records)
+
+    def _commit_records(self, records: List[Dict]):
+        with self._db:
+            for record in records:
+                self._apply_sql(record)
+                cursor = self._db.execute('INSERT INTO changes (record) VALUES (?)',
+                                          (json.dumps(record, separators=(',', ':')),))
+                self.seq = cursor.lastrowid
+            if self.seq - self._trimmed_at >= self.keep_changes:
+                self._db.execute('DELETE FROM changes WHERE seq <= ?', (self.seq - self.keep_changes,))
+                self._trimmed_at = self.seq
+
+    def changed(self) -> bool:
+        """True if another connection committed since the last sync"""
+        return self._data_version() != self._known
+
+    def poll(self) -> Optional[List[Dict]]:
+        """Records committed by other processes since the last sync, or None to reload"""
+        if not self.changed():
+            return []
+        self._known = self._data_version()
+        rows = self._db.execute('SELECT seq, record FROM changes WHERE seq > ? ORDER BY seq',
+                                (self.seq,)).fetchall()
+        if not rows:
+            return []
+        if rows[0][0] != self.seq + 1:
+            # Our position was trimmed away or the table was rewritten
+            return None
+        records = [json.loads(record) for seq, record in rows]
+        if any(record['op'] == 'reload' for record in records):
+            return None
+        self.seq = rows[-1][0]
+        return records
+
+    def find_loans(self, user: Optional[str] = None, book: Optional[str] = None,
+                   due_before: Optional[str] = None) -> Dict[str, Dict]:
+        """Loans matching all given filters, looked up through the indexes"""
+        clauses, params = [], []
+        if user is not None:
+            clauses.append('user = ?')
+            params.append(user)
+        if book is not None:
+            clauses.append('book = ?')
+            params.append(book)
+        if due_before is not None:
+            clauses.append('due_date < ?')
+            params.append(due_before)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        rows = self._db.execute(
+            f'SELECT id, user, book, issue_date, due_date FROM loans {where} ORDER BY due_date', params)
+        return {trans_id: {'user': loan_user, 'book': loan_book, 'issue_date': issue_date, 'due_date': due_date}
+                for trans_id, loan_user, loan_book, issue_date, due_date in rows}
+
+    def close(self):
+        self._db.close()
+
+    def _apply_sql(self, record: Dict):
+        op = record['op']
+        if op == 'issue':
+            self._db.execute('UPDATE books SET available_copies = available_copies - 1 WHERE title = ?',
+                             (record['book'],))
+            self._db.execute('INSERT INTO loans (id, user, book, issue_date, due_date) VALUES (?, ?, ?, ?, ?)',
+                             (record['id'], record['user'], record['book'],
+                              record['issue_date'], record['due_date']))
+            if record['id'].isdigit():
+                self._db.execute("INSERT INTO meta (key, value) VALUES ('loan_seq', ?) "
+                                 "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)",
+                                 (int(record['id']),))
+        elif op == 'return':
+            row = self._db.execute('SELECT book FROM loans WHERE id = ?', (record['id'],)).fetchone()
+            if row is not None:
+                self._db.execute('DELETE FROM loans WHERE id = ?', (record['id'],))
+                self._db.execute('UPDATE books SET available_copies = available_copies + 1 WHERE title = ?',
+                                 row)
+        elif op == 'add':
+            self._db.execute('INSERT INTO books (title, total_copies, available_copies) VALUES (?, ?, ?)',
+                             (record['book'], record['copies'], record['copies']))
+        elif op == 'restock':
+            self._db.execute('UPDATE books SET total_copies = total_copies + ?, '
+                             'available_copies = available_copies + ? WHERE title = ?',
+                             (record['copies'], record['copies'], record['book']))
+
+    def _last_seq(self) -> int:
+        return self._db.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+
+    def _data_version(self) -> int:
+        return self._db.execute('PRAGMA data_version').fetchone()[0]
+
+
+# Binary snapshot layout (all integers little-endian):
+#   header: magic, journal_seq, loan_seq, offset of the books table, offset of the loans table
+#   table:  entry count n, n + 1 entry offsets, n entry numbers in key order, entries
+#   entry:  key, then the record fields; strings are a u32 length and UTF-8 bytes
+SNAPSHOT_MAGIC = b'LMSSNAP1'
+_SNAPSHOT_HEADER = struct.Struct('<8sQQQQ')
+_U32 = struct.Struct('<I')
+_U64 = struct.Struct('<Q')
+_COPIES = struct.Struct('<qq')
+
+
+def _pack_str(text: str) -> bytes:
+    raw = text.encode('utf-8')
+    return _U32.pack(len(raw)) + raw
+
+
+def _unpack_str(buf, offset: int) -> Tuple[str, int]:
+    (size,) = _U32.unpack_from(buf, offset)
+    start = offset + _U32.size
+    return str(buf[start:start + size], 'utf-8'), start + size
+
+
+def _encode_book(info: Dict) -> bytes:
+    return _COPIES.pack(info['total_copies'], info['available_copies'])
+
+
+def _decode_book(buf, offset: int) -> BookRecord:
+    return BookRecord(*_COPIES.unpack_from(buf, offset))
+
+
+def _encode_loan(details: Dict) -> bytes:
+    return b''.join(_pack_str(details[field]) for field in _LOAN_FIELDS)
+
+
+def _decode_loan(buf, offset: int) -> LoanRecord:
+    user, offset = _unpack_str(buf, offset)
+    book, offset = _unpack_str(buf, offset)
+    issue_date, offset = _unpack_str(buf, offset)
+    due_date, offset = _unpack_str(buf, offset)
+    return LoanRecord(user, book, issue_date, due_date)
+
+
+class SnapshotTable:
+    """Read-only view of one table of a binary snapshot, decoding entries on request"""
+
+    def __init__(self, buf, offset: int, decode_value: Callable):
+        self.buf = buf
+        self.decode_value = decode_value
+        (self.count,) = _U64.unpack_from(buf, offset)
+        self._offsets = offset + _U64.size
+        self._order = self._offsets + _U64.size * (self.count + 1)
+        self._keys: Optional[List[str]] = None
+
+    def _start(self, position: int) -> int:
+        return _U64.unpack_from(self.buf, self._offsets + _U64.size * position)[0]
+
+    def keys(self) -> List[str]:
+        """All keys in file order, decoded in one pass on first use"""
+        if self._keys is None:
+            buf = self.buf
+            starts = struct.unpack_from(f'<{self.count}Q', buf, self._offsets)
+            keys = []
+            for start in starts:
+                (size,) = _U32.unpack_from(buf, start)
+                keys.append(str(buf[start + _U32.size:start + _U32.size + size], 'utf-8'))
+            self._keys = keys
+        return self._keys
+
+    def key_at(self, position: int) -> str:
+        if self._keys is not None:
+            return self._keys[position]
+        return _unpack_str(self.buf, self._start(position))[0]
+
+    def value_at(self, position: int):
+        start = self._start(position)
+        (size,) = _U32.unpack_from(self.buf, start)
+        return self.decode_value(self.buf, start + _U32.size + size)
+
+    def raw_at(self, position: int) -> bytes:
+        """Encoded bytes of an entry, key included"""
+        return self.buf[self._start(position):self._start(position + 1)]
+
+    def find(self, key: str) -> int:
+        """Position of key in file order, or -1; a binary search over the key order"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            (position,) = _U32.unpack_from(self.buf, self._order + _U32.size * middle)
+            found = self.key_at(position)
+            if found == key:
+                return position
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        return -1
+
+
+class LazyTable(MutableMapping):
+    """Dict-like table over a snapshot, decoding each record the first time it is read.
+
+    Decoded records are kept, so changes made to them stick. Writes go to
+    an in-memory overlay and the snapshot itself is never modified.
+    Iteration follows the snapshot's order, then keys added since.
+    """
+
+    def __init__(self, table: SnapshotTable, intern_keys: bool = False):
+        self.table = table
+        self.intern_keys = intern_keys
+        self._decoded: Dict[str, Record] = {}  # Snapshot entries read or replaced
+        self._added: Dict[str, Record] = {}    # Keys that are not in the snapshot
+        self._deleted = set()                  # Snapshot keys removed since
+
+    def __getitem__(self, key: str):
+        value = self._decoded.get(key)
+        if value is not None:
+            return value
+        if key in self._added:
+            return self._added[key]
+        position = -1 if key in self._deleted else self.table.find(key)
+        if position < 0:
+            raise KeyError(key)
+        value = self._decoded[key] = self.table.value_at(position)
+        return value
+
+    def __contains__(self, key) -> bool:
+        if key in self._decoded or key in self._added:
+            return True
+        return isinstance(key, str) and key not in self._deleted and self.table.find(key) >= 0
+
+    def __setitem__(self, key: str, value):
+        if key in self._decoded or (key not in self._deleted and self.table.find(key) >= 0):
+            self._decoded[key] = value
+        else:
+            self._added[key] = value
+
+    def __delitem__(self, key: str):
+        if key in self._added:
+            del self._added[key]
+        elif key in self:
+            self._decoded.pop(key, None)
+            self._deleted.add(key)
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.table.keys():
+            if key not in self._deleted:
+                yield intern(key) if self.intern_keys else key
+        yield from list(self._added)
+
+    def __len__(self) -> int:
+        return self.table.count - len(self._deleted) + len(self._added)
+
+    def items(self) -> Iterator[Tuple[str, Record]]:
+        """Walk the table in order without a key lookup per entry"""
+        for position, key in enumerate(self.table.keys()):
+            if key in self._deleted:
+                continue
+            value = self._decoded.get(key)
+            if value is None:
+                if self.intern_keys:
+                    key = intern(key)
+                value = self._decoded[key] = self.table.value_at(position)
+            yield key, value
+        yield from list(self._added.items())
+
+    def values(self) -> Iterator[Record]:
+        return (value for _, value in self.items())
+
+    def encoded_entries(self, encode_value: Callable[[Dict], bytes]) -> Iterator[Tuple[str, bytes]]:
+        """(key, entry bytes) pairs; entries never decoded are copied without decoding"""
+        for position, key in enumerate(self.table.keys()):
+            if key in self._deleted:
+                continue
+            value = self._decoded.get(key)
+            if value is None:
+                yield key, self.table.raw_at(position)
+            else:
+                yield key, _pack_str(key) + encode_value(value)
+        for key, value in self._added.items():
+            yield key, _pack_str(key) + encode_value(value)
+
+
+def _encode_table(table: Mapping, encode_value: Callable[[Dict], bytes], start: int) -> bytes:
+    if isinstance(table, LazyTable):
+        entries = table.encoded_entries(encode_value)
+    else:
+        entries = ((key, _pack_str(key) + encode_value(value)) for key, value in table.items())
+    keys, chunks = [], []
+    for key, chunk in entries:
+        keys.append(key)
+        chunks.append(chunk)
+
+    count = len(keys)
+    offset = start + _U64.size * (count + 2) + _U32.size * count
+    offsets = [offset]
+    for chunk in chunks:
+        offset += len(chunk)
+        offsets.append(offset)
+    order = sorted(range(count), key=keys.__getitem__)
+    return b''.join([_U64.pack(count), struct.pack(f'<{count + 1}Q', *offsets),
+                     struct.pack(f'<{count}I', *order)] + chunks)
+
+
+def encode_snapshot(data: Dict, journal_seq: int = 0) -> bytes:
+    """Serialize library data to the binary snapshot format"""
+    books = _encode_table(data['books'], _encode_book, _SNAPSHOT_HEADER.size)
+    loans_offset = _SNAPSHOT_HEADER.size + len(books)
+    loans = _encode_table(data['issued_books'], _encode_loan, loans_offset)
+    header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, journal_seq, data.get('loan_seq', 0),
+                                   _SNAPSHOT_HEADER.size, loans_offset)
+    return b''.join((header, books, loans))
+
+
+def read_snapshot(buf) -> Dict:
+    """Open a binary snapshot held in buf (bytes or an mmap) without decoding its records"""
+    magic, journal_seq, loan_seq, books_offset, loans_offset = _SNAPSHOT_HEADER.unpack_from(buf, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError('Not a library snapshot file.')
+    return {
+        'books': LazyTable(SnapshotTable(buf, books_offset, _decode_book), intern_keys=True),
+        'issued_books': LazyTable(SnapshotTable(buf, loans_offset, _decode_loan)),
+        'journal_seq': journal_seq,
+        'loan_seq': loan_seq,
+    }
+
+
+class BinaryStorage(JournalStorage):
+    """Journal storage with a memory-mapped binary snapshot instead of a JSON one.
+
+    Opening the library maps the snapshot (reads it, on Windows) and
+    decodes only its header, so startup time barely grows with the number
+    of books and loans. Records are decoded one by one on first access
+    through an offset index, and compaction copies entries that were never
+    decoded byte for byte. A ``.json`` data file name is mapped to the
+    matching ``.bin``.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        if path.endswith('.json'):
+            path = path[:-len('.json')] + '.bin'
+        super().__init__(path, **kwargs)
+
+    def _read_snapshot(self) -> Dict:
+        with open(self.path, 'rb') as f:
+            if os.name == 'nt':
+                # Windows can't replace a file while a mapping of it is open,
+                # which compaction and save do; read it instead (still decoded lazily)
+                return read_snapshot(f.read())
+            # On POSIX the mapping stays valid after the file is closed or replaced
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return read_snapshot(buf)
+
+    def _snapshot(self, data: Dict) -> bytes:
+        # Encoding reads the mapped entries of data, so it can't be deferred
+        return encode_snapshot(data, self.seq)
+
+    def _encode(self, snapshot: bytes) -> bytes:
+        return snapshot
+
+
+class WriteBehindStorage:
+    """Wraps a backend so commits return at once and a writer thread persists them.
+
+    Records queued while the writer is busy are committed together, so a
+    burst of issues costs one write and one fsync. ``flush`` writes out
+    everything queued so far before returning; ``close`` flushes and stops
+    the writer. The writer holds ``data_lock`` (the library's lock) only
+    while it takes a batch and serializes the data that goes with it; the
+    file write and fsync happen after releasing it, so reads don't wait on
+    the disk. ``lock`` is held throughout, so it must be taken before
+    ``data_lock`` everywhere.
+
+    Only use this when a single process writes the data file: other
+    processes can't see queued records before they are written.
+    """
+
+    def __init__(self, inner, data_lock, retry_seconds: float = 1.0):
+        self.inner = inner
+        self.lock = inner.lock
+        self.data_lock = data_lock
+        self.retry_seconds = retry_seconds
+        self.error: Optional[BaseException] = None
+        self._data = None
+        self._pending: List[Dict] = []
+        self._closing = False
+        self._cond = threading.Condition()
+        self._writer = threading.Thread(target=self._run, name='write-behind', daemon=True)
+        self._writer.start()
+        # Daemon threads die with the interpreter; write the queue out first
+        atexit.register(self.flush)
+
+    def load(self) -> Optional[Dict]:
+        return self.inner.load()
+
+    def save(self, data: Dict):
+        """Write a full copy of data; queued records are part of it"""
+        with self._cond:
+            self._pending = []
+        self.inner.save(data)
+
+    def commit(self, data: Dict, records: List[Dict]):
+        """Queue records for the writer thread"""
+        with self._cond:
+            self._data = data
+            self._pending.extend(records)
+            self._cond.notify()
+
+    def changed(self) -> bool:
+        return self.inner.changed()
+
+    def poll(self) -> Optional[List[Dict]]:
+        return self.inner.poll()
+
+    def flush(self):
+        """Write queued records now, in the calling thread; raises if writing fails"""
+        self._write_pending()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._writer.join()
+        atexit.unregister(self.flush)
+        self.flush()
+        self.inner.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                if self._closing:
+                    return
+            if not self._write_pending():
+                # Disk full or similar: keep the records and try again later
+                with self._cond:
+                    self._cond.wait(self.retry_seconds)
+
+    def _write_pending(self) -> bool:
+        with self.inner.lock:
+            with self.data_lock:
+                # Taken under the data lock, so a concurrent save can't have written them already
+                with self._cond:
+                    batch, self._pending = self._pending, []
+                if not batch:
+                    return True
+                try:
+                    write = self.inner.prepare_commit(self._data, batch)
+                except Exception as e:
+                    return self._requeue(batch, e)
+            try:
+                write()
+            except Exception as e:
+                return self._requeue(batch, e)
+            self.error = None
+            return True
+
+    def _requeue(self, batch: List[Dict], error: Exception) -> bool:
+        with self._cond:
+            self._pending[:0] = batch
+        self.error = error
+        return False
+
+
+STORAGE_BACKENDS = {
+    'json': JSONStorage,
+    'journal': JournalStorage,
+    'sqlite': SQLiteStorage,
+    'binary': BinaryStorage,
+}
+
+
+def open_storage(kind: str, path: str):
+    """Create a storage backend by name"""
+    if kind not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend '{kind}'. Choose from: {', '.join(STORAGE_BACKENDS)}")
+    return STORAGE_BACKENDS[kind](path)